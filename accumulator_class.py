@@ -0,0 +1,132 @@
+import numpy as np
+
+
+class GrowableArray:
+    """
+    Array-backed accumulator for fixed-shape samples (e.g. one (8, 26) PSD frame per tick).
+    Samples are written into a preallocated buffer whose capacity doubles when full, so appending
+    is amortised O(1) instead of copying the whole history like np.concatenate / np.append do.
+    """
+    def __init__(self, item_shape=(), initial_capacity=256, dtype=np.float64):
+        self.item_shape = tuple(item_shape)
+        self.dtype = dtype
+        self.initial_capacity = max(1, int(initial_capacity))
+        self._data = np.empty((self.initial_capacity,) + self.item_shape, dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return self._data.shape[0]
+
+    def append(self, item):
+        """Copies one sample of shape item_shape into the next free slot, growing the buffer if needed."""
+        if self._size == self._data.shape[0]:
+            self._grow()
+        self._data[self._size] = item
+        self._size += 1
+
+    def _grow(self):
+        new_data = np.empty((self._data.shape[0] * 2,) + self.item_shape, dtype=self.dtype)
+        new_data[:self._size] = self._data[:self._size]
+        self._data = new_data
+
+    def view(self):
+        """Returns a view (no copy) of the filled part of the buffer, shape (len(self),) + item_shape."""
+        return self._data[:self._size]
+
+    def mean(self):
+        """Mean over all samples, computed on the filled view without copying it."""
+        return np.mean(self.view(), axis=0)
+
+    def var(self):
+        """Population variance over all samples."""
+        return np.var(self.view(), axis=0)
+
+    def min(self):
+        return np.min(self.view(), axis=0)
+
+    def max(self):
+        return np.max(self.view(), axis=0)
+
+    def reset(self):
+        """Empties the accumulator. The buffer is kept, so the next song doesn't pay for regrowing it."""
+        self._size = 0
+
+
+class RunningStats:
+    """
+    Online (Welford) mean/variance, min/max and count for fixed-shape samples.
+    Memory is O(1) in the number of samples, so a 60 minute track costs the same as a 3 minute one.
+    Has the same append/mean/var/reset interface as GrowableArray so the two are interchangeable.
+
+    Parameters:
+        item_shape (tuple): Shape of a single sample. Default: () for scalars.
+        reservoir_size (int): If > 0, keeps a uniform reservoir sample of that many items so that
+            approximate quantiles can be computed. Default: 0 (disabled).
+    """
+    def __init__(self, item_shape=(), reservoir_size=0, seed=None):
+        self.item_shape = tuple(item_shape)
+        self.reservoir_size = int(reservoir_size)
+        self._rng = np.random.default_rng(seed)
+        self.reset()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, item):
+        """Folds one sample into the running statistics."""
+        x = np.asarray(item, dtype=np.float64)
+        self.count += 1
+        delta = x - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (x - self._mean)
+        np.minimum(self._min, x, out=self._min)
+        np.maximum(self._max, x, out=self._max)
+
+        if self.reservoir_size > 0:
+            # Algorithm R: every sample seen so far has equal probability of being in the reservoir
+            if self.count <= self.reservoir_size:
+                self._reservoir[self.count - 1] = x
+            else:
+                j = self._rng.integers(0, self.count)
+                if j < self.reservoir_size:
+                    self._reservoir[j] = x
+
+    def mean(self):
+        if self.count == 0:
+            return np.full(self.item_shape, np.nan)[()]
+        # [()] turns 0-d results into numpy scalars, like np.mean over a 1-d array
+        return self._mean.copy()[()]
+
+    def var(self):
+        """Population variance (ddof=0), matching np.var."""
+        if self.count == 0:
+            return np.full(self.item_shape, np.nan)[()]
+        return (self._m2 / self.count)[()]
+
+    def min(self):
+        return self._min.copy()[()]
+
+    def max(self):
+        return self._max.copy()[()]
+
+    def quantile(self, q):
+        """Approximate quantile(s) from the reservoir sample. Requires reservoir_size > 0."""
+        if self.reservoir_size <= 0:
+            raise ValueError("quantile() needs a RunningStats created with reservoir_size > 0")
+        filled = min(self.count, self.reservoir_size)
+        if filled == 0:
+            return np.full(np.shape(q) + self.item_shape, np.nan)
+        return np.quantile(self._reservoir[:filled], q, axis=0)
+
+    def reset(self):
+        self.count = 0
+        self._mean = np.zeros(self.item_shape)
+        self._m2 = np.zeros(self.item_shape)
+        self._min = np.full(self.item_shape, np.inf)
+        self._max = np.full(self.item_shape, -np.inf)
+        if self.reservoir_size > 0:
+            self._reservoir = np.empty((self.reservoir_size,) + self.item_shape)
@@ -0,0 +1,98 @@
+"""
+Compares the per-row eeg_metrics decoding of SpotifyAPI.get_eeg_data_from_DB with the bulk loader
+(eeg_loader.load_eeg_metrics) on a synthetic database.
+
+Usage:
+    python benchmarks/bench_eeg_loader.py --rows 100000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from eeg_loader import load_eeg_metrics
+
+
+def make_database(db_name, rows, songs=1000):
+    rng = np.random.default_rng(0)
+    conn = sqlite3.connect(db_name)
+    conn.execute('''
+        CREATE TABLE eeg_metrics (
+            song_id TEXT, timestamp TIMESTAMP, psd BLOB, alpha BLOB, beta BLOB, delta BLOB, gamma BLOB, theta BLOB,
+            focus_score REAL, calm_score REAL, user_id TEXT, user_name TEXT,
+            year INTEGER, month INTEGER, day INTEGER, weekday INTEGER, hour INTEGER
+        )
+    ''')
+    conn.executemany(
+        "INSERT INTO eeg_metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        ((f"song{i % songs}", "2024-01-01 12:00:00", rng.random(208).tobytes(),
+          *(rng.random(8).tobytes() for _ in range(5)), rng.random(), rng.random(), "user", "name",
+          2024, 1, 1, 0, 12) for i in range(rows))
+    )
+    conn.commit()
+    return conn
+
+
+def load_per_row(conn):
+    """The decoding done by SpotifyAPI.get_eeg_data_from_DB, applied to every row."""
+    rows = conn.execute('''
+        SELECT song_id, timestamp, psd, alpha, beta, delta, gamma, theta,
+               focus_score, calm_score, year, month, day, weekday, hour
+        FROM eeg_metrics
+    ''').fetchall()
+    processed_data = []
+    for (song_id, timestamp, psd_blob, alpha_blob, beta_blob, delta_blob, gamma_blob, theta_blob,
+         focus_score, calm_score, year, month, day, weekday, hour) in rows:
+        processed_data.append({
+            "song_id": song_id, "timestamp": timestamp,
+            "psd": np.frombuffer(psd_blob, dtype=np.float64),
+            "alpha": np.frombuffer(alpha_blob, dtype=np.float64),
+            "beta": np.frombuffer(beta_blob, dtype=np.float64),
+            "delta": np.frombuffer(delta_blob, dtype=np.float64),
+            "gamma": np.frombuffer(gamma_blob, dtype=np.float64),
+            "theta": np.frombuffer(theta_blob, dtype=np.float64),
+            "focus_score": focus_score, "calm_score": calm_score,
+            "year": year, "month": month, "day": day, "weekday": weekday, "hour": hour
+        })
+    # Stacking is what analysis code has to do with the per-row result anyway
+    return np.stack([row["psd"] for row in processed_data])
+
+
+def best_of(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = perf_counter()
+        function()
+        timings.append(perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Building a database with {args.rows} eeg_metrics rows...")
+        conn = make_database(os.path.join(tmp, "bench.db"), args.rows)
+
+        assert np.array_equal(load_per_row(conn), load_eeg_metrics(conn)["psd"])
+
+        per_row = best_of(lambda: load_per_row(conn), args.repeats)
+        bulk = best_of(lambda: load_eeg_metrics(conn), args.repeats)
+        bulk_df = best_of(lambda: load_eeg_metrics(conn, as_dataframe=True), args.repeats)
+        conn.close()
+
+    print(f"per-row decode:       {per_row:8.3f} s")
+    print(f"bulk (dict of arrays): {bulk:8.3f} s  ({per_row / bulk:.1f}x)")
+    print(f"bulk (DataFrame):      {bulk_df:8.3f} s  ({per_row / bulk_df:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
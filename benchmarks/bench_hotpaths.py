@@ -0,0 +1,230 @@
+"""
+Benchmarks for the code paths that run at 4 Hz (or faster) for as long as a session lasts.
+Uses the replay device and fake Spotify client from simulator_class, so no hardware or network is needed.
+Reports per-call latency percentiles and the peak memory allocated (tracemalloc) per benchmark.
+
+Usage:
+    python benchmarks/bench_hotpaths.py            # full run (songs up to 60 minutes, 10k row database)
+    python benchmarks/bench_hotpaths.py --quick    # smaller sizes, for CI
+    python benchmarks/bench_hotpaths.py --only gather
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from neurosity_class import NeurosityVectorizer, export_images
+from simulator_class import ReplayDevice, FakeSpotify
+from spotify_class import SpotifyAPI
+
+TICKS_PER_MINUTE = 4 * 60  # the monitor loop samples at 4 Hz
+
+
+def quiet():
+    """The collection code prints on most calls, keep that out of the report."""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def percentiles(timings):
+    timings = np.asarray(timings) * 1e6
+    return {"n": len(timings), "p50": np.percentile(timings, 50), "p90": np.percentile(timings, 90),
+            "p99": np.percentile(timings, 99), "max": timings.max()}
+
+
+def run(function, calls, reset=None, alloc_function=None):
+    """
+    Calls function() calls times, timing each call, then (after reset(), if given) calls it (or alloc_function,
+    if given) calls times again under tracemalloc, which would distort the timings.
+
+    Returns:
+        tuple: (per-call timings in seconds, peak memory allocated during the second pass in bytes)
+    """
+    timings = np.empty(calls)
+    with quiet():
+        for i in range(calls):
+            start = perf_counter()
+            function()
+            timings[i] = perf_counter() - start
+
+        if reset is not None:
+            reset()
+        alloc_function = alloc_function or function
+        tracemalloc.start()
+        for i in range(calls):
+            alloc_function()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return timings, peak
+
+
+def report(name, timings, peak, extra=""):
+    stats = percentiles(timings)
+    print(f"{name:<42} {stats['n']:>7} {stats['p50']:>9.1f} {stats['p90']:>9.1f} {stats['p99']:>9.1f} "
+          f"{stats['max']:>10.1f} {peak / 1024:>10.1f}  {extra}")
+
+
+def make_vectorizer(**kwargs):
+    device = ReplayDevice(autoplay=False)
+    with quiet():
+        vectorizer = NeurosityVectorizer(device, **kwargs)
+    device.step()
+    return device, vectorizer
+
+
+def bench_export(args):
+    device, vectorizer = make_vectorizer()
+    report("export_np", *run(vectorizer.export_np, args.calls))
+    report("export_image", *run(vectorizer.export_image, args.calls))
+    # A whole session at once, e.g. an hour at 4 Hz
+    with quiet():
+        vectors = vectorizer.sample(args.session_vectors, 1e6)
+    timings, peak = run(lambda: export_images(vectors), 5)
+    report(f"export_images ({args.session_vectors} vectors)", timings, peak,
+           f"{args.session_vectors / np.median(timings):.0f} images/s")
+
+
+def bench_gather(args):
+    # Every tick delivers one frame of each stream (device.step) and gathers it: by polling, or on the collector
+    # thread (event-driven, where the tick only pays for the callbacks waking it up).
+    def tick(device, vectorizer):
+        if vectorizer.event_driven:
+            vectorizer.start_recording()
+            return device.step
+        return lambda: (device.step(), vectorizer.gather_eeg_samples_during_song())
+
+    for minutes in args.song_minutes:
+        ticks = minutes * TICKS_PER_MINUTE
+        for mode in ("buffered", "streaming", "event"):
+            options = {"streaming_stats": mode != "buffered", "event_driven": mode == "event"}
+            if mode == "event":
+                # The ticks come back to back, far faster than the device's 4 Hz, so the collector thread can fall
+                # behind. Big enough channels keep every frame, so all modes gather the same frames.
+                options["channel_size"] = ticks + 1
+            device, vectorizer = make_vectorizer(**options)
+            # A fresh vectorizer for the allocation pass, so buffer growth over the song is counted again
+            fresh_device, fresh_vectorizer = make_vectorizer(**options)
+            timings, peak = run(tick(device, vectorizer), ticks, alloc_function=tick(fresh_device, fresh_vectorizer))
+            # Gathers what the collector thread hasn't yet
+            vectorizer.stop_recording()
+            fresh_vectorizer.close()
+            start = perf_counter()
+            with quiet():
+                eeg_dict = vectorizer.get_current_song_eeg_data()
+            finalize = perf_counter() - start
+            report(f"step + gather ({minutes} min, {mode})", timings, peak,
+                   f"total {timings.sum() * 1e3:.1f} ms, finalize {finalize * 1e3:.2f} ms, "
+                   f"{eeg_dict['sample_count']} frames, {vectorizer.get_channel_stats()['psd']['dropped']} dropped")
+            vectorizer.close()
+
+
+def make_api(db_name):
+    with quiet():
+        spotify_api = SpotifyAPI(None, None, db_name=db_name, api=FakeSpotify(num_tracks=20000, manual=True))
+        spotify_api.initialize_database(db_name)
+    return spotify_api
+
+
+def song_eeg_dict(vectorizer, device, ticks=32):
+    with quiet():
+        for _ in range(ticks):
+            device.step()
+            vectorizer.gather_eeg_samples_during_song()
+        eeg_dict = vectorizer.get_current_song_eeg_data()
+        vectorizer.reset_current_song_eeg_data()
+    return eeg_dict
+
+
+def bench_database_writes(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "bench.db")
+        spotify_api = make_api(db_name)
+        device, vectorizer = make_vectorizer()
+        eeg_dict = song_eeg_dict(vectorizer, device)
+        fake = spotify_api.API
+
+        def add_song():
+            fake.next_track()
+            spotify_api.add_song_to_database(spotify_api.get_current_song_metrics(), db_name)
+
+        # The timed writes are committed (and the commit timed) before the tracemalloc pass starts, so the rates
+        # only count the writes that were timed
+        flushes = []
+
+        def timed_flush():
+            start = perf_counter()
+            spotify_api.flush(db_name)
+            flushes.append(perf_counter() - start)
+
+        timings, peak = run(add_song, args.writes, reset=timed_flush)
+        report("add_song_to_database", timings, peak,
+               f"{args.writes / (timings.sum() + flushes[-1]):.0f} songs/s incl. flush")
+        spotify_api.flush(db_name)
+
+        song_ids = fake.tracks[1:args.writes + 1]
+        timings, peak = run(lambda: spotify_api.add_eeg_metrics(song_ids[0], eeg_dict, db_name), args.writes,
+                            reset=timed_flush)
+        report("add_eeg_metrics", timings, peak, f"{args.writes / (timings.sum() + flushes[-1]):.0f} rows/s incl. flush")
+        spotify_api.close()
+
+
+def bench_database_reads(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "bench.db")
+        spotify_api = make_api(db_name)
+        device, vectorizer = make_vectorizer()
+        eeg_dict = song_eeg_dict(vectorizer, device)
+        fake = spotify_api.API
+
+        # A realistic database: many songs, a few listens each
+        songs = max(1, args.db_rows // 5)
+        with quiet():
+            for i in range(songs):
+                fake.next_track()
+                spotify_api.add_song_to_database(spotify_api.get_current_song_metrics(), db_name)
+            for i in range(args.db_rows):
+                spotify_api.add_eeg_metrics(fake.tracks[1 + i % songs], eeg_dict, db_name)
+        spotify_api.flush(db_name)
+
+        rng = np.random.default_rng(0)
+        lookups = iter(rng.integers(1, songs + 1, 2 * args.reads))
+        report(f"get_eeg_data_from_DB ({args.db_rows} rows)",
+               *run(lambda: spotify_api.get_eeg_data_from_DB(fake.tracks[next(lookups)], db_name), args.reads))
+        report(f"load_eeg_metrics ({args.db_rows} rows)", *run(lambda: spotify_api.load_eeg_metrics(db_name), 5))
+        spotify_api.close()
+
+
+BENCHMARKS = {
+    "export": bench_export,
+    "gather": bench_gather,
+    "db_writes": bench_database_writes,
+    "db_reads": bench_database_reads,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for CI")
+    parser.add_argument("--only", choices=list(BENCHMARKS), action="append")
+    args = parser.parse_args()
+
+    args.calls = 1000 if args.quick else 10000
+    args.song_minutes = [1, 5] if args.quick else [1, 5, 15, 30, 60]
+    args.writes = 200 if args.quick else 2000
+    args.db_rows = 1000 if args.quick else 10000
+    args.reads = 200 if args.quick else 1000
+    args.session_vectors = 1000 if args.quick else 4 * 3600
+
+    print(f"{'benchmark':<42} {'n':>7} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9} {'max us':>10} {'peak KiB':>10}")
+    for name in args.only or BENCHMARKS:
+        BENCHMARKS[name](args)
+
+
+if __name__ == "__main__":
+    main()
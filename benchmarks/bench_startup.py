@@ -0,0 +1,87 @@
+"""
+Measures what a (re)start of main.py costs before EEG is collected: importing the modules, in a fresh interpreter
+each time like after a crash, creating the SpotifyAPI and NeurosityVectorizer, and fetching the Spotify user
+profile, the one Spotify round trip main() waits for. Uses the replay device and fake Spotify client from
+simulator_class, with a simulated network latency, so no hardware or network is needed. The budget includes that
+round trip, so a higher --latency counts against it.
+The Neurosity login itself isn't included, it's a network round trip the script can't do without.
+
+Exits with status 1 if the total is over the budget.
+
+Usage:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --budget 1.0 --latency 0.3
+"""
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# What main.py imports (neurosity only when it logs in)
+MODULES = ["numpy", "neurosity_class", "spotify_class", "playback_class", "scheduler_class"]
+
+
+def import_time(module, repeat):
+    """Best time, in seconds, to import module in a new interpreter (the interpreter's own startup excluded)."""
+    code = f"from time import perf_counter; start = perf_counter(); import {module}; print(perf_counter() - start)"
+    times = [float(subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True,
+                                  check=True).stdout) for _ in range(repeat)]
+    return min(times)
+
+
+def construction_time(latency):
+    from neurosity_class import NeurosityVectorizer
+    from simulator_class import ReplayDevice, FakeSpotify
+    from spotify_class import SpotifyAPI
+
+    fake = FakeSpotify(latency=latency)
+    device = ReplayDevice(autoplay=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = perf_counter()
+        spotify_api = SpotifyAPI(None, None, api=fake)
+        # Like main(), which fetches the profile before the database writer starts
+        spotify_api.get_current_user()
+        NeurosityVectorizer(device, streaming_stats=True, record_samples=True, event_driven=True,
+                            monitor_quality=True, min_quality=0.5)
+        elapsed = perf_counter() - start
+        # The profile is cached, later calls don't go to Spotify
+        spotify_api.get_current_user()
+    return elapsed, fake.calls.get("current_user", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds allowed in total. Default: 1.0")
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds per fake Spotify call. Default: 0.3")
+    parser.add_argument("--repeat", type=int, default=3, help="imports timed per module. Default: 3")
+    args = parser.parse_args()
+
+    print(f"{'step':<32} {'ms':>9}")
+    total = 0.
+    for module in MODULES:
+        elapsed = import_time(module, args.repeat)
+        print(f"{'import ' + module:<32} {elapsed * 1e3:>9.1f}")
+    # Modules share their imports, so the total is one interpreter importing them all
+    elapsed = import_time(", ".join(MODULES), args.repeat)
+    print(f"{'import (all)':<32} {elapsed * 1e3:>9.1f}")
+    total += elapsed
+
+    elapsed, user_calls = construction_time(args.latency)
+    print(f"{'SpotifyAPI + user + Vectorizer':<32} {elapsed * 1e3:>9.1f}  ({user_calls} current_user call, "
+          f"{args.latency * 1e3:.0f} ms latency)")
+    total += elapsed
+
+    print(f"{'total':<32} {total * 1e3:>9.1f}  budget {args.budget * 1e3:.0f}")
+    if total > args.budget:
+        print("Startup is over budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
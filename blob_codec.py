@@ -0,0 +1,90 @@
+"""
+Versioned encoding for the vector BLOBs in the database.
+
+    magic "MBA" | version (u8) | dtype code (u8) | flags (u8) | ndim (u8) | shape (ndim x u32) | payload
+
+Everything is little-endian. The payload is the C-ordered array data, zlib-compressed if flags & FLAG_ZLIB.
+BLOBs without the magic are the legacy format: raw float64 bytes with no shape information.
+"""
+import struct
+import zlib
+
+import numpy as np
+
+
+MAGIC = b"MBA"
+VERSION = 1
+FLAG_ZLIB = 1
+
+_HEADER = struct.Struct("<3sBBBB")
+_DTYPE_CODES = {1: np.dtype("<f4"), 2: np.dtype("<f8"), 3: np.dtype("<f2")}
+_CODES_BY_DTYPE = {dtype: code for code, dtype in _DTYPE_CODES.items()}
+
+
+def is_encoded(blob):
+    """True if blob uses the versioned format, False for legacy raw float64 blobs."""
+    return blob is not None and bytes(blob[:len(MAGIC)]) == MAGIC
+
+
+def header_size(ndim):
+    return _HEADER.size + 4 * ndim
+
+
+def encode_array(array, dtype=np.float32, compress=False):
+    """
+    Encodes an array as a versioned BLOB.
+
+    Parameters:
+        array (np.ndarray): The array (any shape) to encode.
+        dtype: Storage dtype, one of float16/float32/float64. Default: float32, half the size of float64.
+        compress (bool): zlib-compress the payload. Default: False
+
+    Returns:
+        bytes: The encoded BLOB.
+    """
+    array = np.ascontiguousarray(array, dtype=np.dtype(dtype).newbyteorder("<"))
+    code = _CODES_BY_DTYPE.get(array.dtype)
+    if code is None:
+        raise ValueError(f"Unsupported BLOB dtype: {array.dtype}")
+    payload = array.tobytes()
+    flags = 0
+    if compress:
+        payload = zlib.compress(payload)
+        flags |= FLAG_ZLIB
+    header = _HEADER.pack(MAGIC, VERSION, code, flags, array.ndim) + struct.pack(f"<{array.ndim}I", *array.shape)
+    return header + payload
+
+
+def decode_header(blob):
+    """Returns (version, dtype, flags, shape, payload offset) of an encoded BLOB."""
+    magic, version, code, flags, ndim = _HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("Not an encoded BLOB")
+    if version > VERSION:
+        raise ValueError(f"BLOB format version {version} is newer than this reader ({VERSION})")
+    shape = struct.unpack_from(f"<{ndim}I", blob, _HEADER.size)
+    return version, _DTYPE_CODES[code], flags, shape, header_size(ndim)
+
+
+def decode_array(blob, legacy_shape=None, legacy_dtype=np.float64):
+    """
+    Decodes a BLOB written by encode_array, or a legacy raw BLOB.
+
+    Parameters:
+        blob (bytes): The BLOB.
+        legacy_shape (tuple): Shape to give legacy BLOBs, which don't store one. Default: None (1-D)
+        legacy_dtype: dtype of legacy BLOBs. Default: float64
+
+    Returns:
+        np.ndarray: The decoded (read-only) array, or None for a NULL BLOB.
+    """
+    if blob is None:
+        return None
+    if not is_encoded(blob):
+        array = np.frombuffer(blob, dtype=legacy_dtype)
+        return array.reshape(legacy_shape) if legacy_shape is not None else array
+
+    _, dtype, flags, shape, offset = decode_header(blob)
+    if flags & FLAG_ZLIB:
+        return np.frombuffer(zlib.decompress(bytes(blob[offset:])), dtype=dtype).reshape(shape)
+    return np.frombuffer(blob, dtype=dtype, offset=offset).reshape(shape)
@@ -1,9 +1,7 @@
-from dotenv import load_dotenv, dotenv_values
+from dotenv import load_dotenv
 from neurosity import NeurositySDK
 import os
 import time
-import numpy as np
-from matplotlib import pyplot as plt
 # import pygame
 from neurosity_class import NeurosityVectorizer
 
@@ -36,9 +34,10 @@ neurosity.login({
 # Create a vectorizer
 vectorizer = NeurosityVectorizer(neurosity)
 
-# create code so that when esure?quality is becomes true, continue with gathering samples
-while not vectorizer.ensure_quality():
-    continue
+# when ensure_quality becomes true, continue with gathering samples. It blocks until a reading arrives,
+# so retrying doesn't spin.
+while not vectorizer.ensure_quality(max_fails=10, timeout=30):
+    print("Adjust the headset for better contact...")
 print("Quality ensured")
 time.sleep(1.5)
 
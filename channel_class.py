@@ -0,0 +1,74 @@
+from collections import deque
+from time import monotonic
+
+
+class FrameChannel:
+    """
+    Bounded single-producer/single-consumer channel for the frames of one device stream.
+    The producer (the SDK callback thread) never takes a lock or waits for the consumer: deque.append and
+    deque.popleft are atomic, and a full channel drops its oldest frame on append.
+
+    Every frame is stored as (sequence number, arrival time, frame, tag), where tag is whatever the producer knew
+    about the frame when it arrived (e.g. the signal quality at that moment). The consumer counts the dropped frames from the
+    gaps in the sequence numbers it receives, so the counter is exact without the two sides sharing any state.
+    latest() reads the newest frame without consuming anything, for readers that only want the current value.
+
+    Parameters:
+        maxlen (int): Maximum number of frames waiting for the consumer. Default: 64
+    """
+    def __init__(self, maxlen=64):
+        self._queue = deque(maxlen=maxlen)
+        self._latest = None
+        self.sent = 0  # written by the producer only
+        self.received = 0  # the rest by the consumer only
+        self.dropped = 0
+        self.discarded = 0
+        self._last_seq = 0
+
+    def put(self, frame, tag=None):
+        """Producer: adds a frame, dropping the oldest waiting one if the channel is full."""
+        item = (self.sent + 1, monotonic(), frame, tag)
+        self._queue.append(item)
+        # One attribute assignment, so latest() never pairs a sequence number with another frame
+        self._latest = item
+        self.sent = item[0]
+
+    def drain(self):
+        """
+        Consumer: takes every waiting frame.
+
+        Returns:
+        list: (sequence number, arrival time, frame, tag) tuples, oldest first.
+        """
+        items = self._take()
+        if items:
+            # Every sequence number since the last one received that isn't here was dropped
+            self.dropped += items[-1][0] - self._last_seq - len(items)
+            self._last_seq = items[-1][0]
+            self.received += len(items)
+        return items
+
+    def discard(self):
+        """Consumer: throws away every waiting frame (e.g. frames from a pause), without counting them as dropped."""
+        items = self._take()
+        if items:
+            self.discarded += items[-1][0] - self._last_seq
+            self._last_seq = items[-1][0]
+        return len(items)
+
+    def latest(self):
+        """Returns (sequence number, arrival time, frame, tag) of the newest frame, consumed or not, or None before the first one."""
+        return self._latest
+
+    def stats(self):
+        return {"sent": self.sent, "received": self.received, "dropped": self.dropped, "discarded": self.discarded,
+                "waiting": len(self._queue)}
+
+    def _take(self):
+        items = []
+        try:
+            while True:
+                items.append(self._queue.popleft())
+        except IndexError:
+            pass
+        return items
@@ -0,0 +1,296 @@
+import atexit
+import queue
+import sqlite3
+from threading import Thread, Event
+from time import monotonic
+
+import numpy as np
+
+
+class BatchWriter:
+    """
+    Base of the background SQLite writers: owns a long-lived connection on a background thread and writes the
+    queued items in batches, one transaction per batch. Items are written in submission order, and everything
+    queued is committed on close() and at interpreter exit.
+    Subclasses implement _write_batch(conn, items), and can extend _connect.
+
+    Parameters:
+        db_name (str): Path of the SQLite database.
+        batch_size (int): Maximum number of queued items written in one transaction.
+        flush_interval (float): Maximum time in seconds an item may wait before being committed.
+        synchronous (str): SQLite synchronous pragma. NORMAL is durable with WAL except on power loss.
+        max_queued (int): Maximum number of items waiting, 0 for no limit. A full queue blocks _put. Default: 0
+    """
+    _STOP = object()
+    # Seconds between checks that the writer thread is still alive, while waiting on it
+    _POLL_INTERVAL = 0.1
+
+    def __init__(self, db_name, batch_size, flush_interval, synchronous, max_queued=0):
+        self.db_name = db_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.synchronous = synchronous
+
+        self.committed_batches = 0
+        self.closed = False
+
+        # Connected here, so a database that can't be opened raises in the caller instead of killing the thread
+        self._conn = self._connect()
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = Thread(target=self._run, name=f"{type(self).__name__}({db_name})", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _check_running(self):
+        if self.closed:
+            raise RuntimeError(f"{type(self).__name__} for '{self.db_name}' is closed")
+        self._check_alive()
+
+    def _check_alive(self):
+        if not self._thread.is_alive():
+            raise RuntimeError(f"{type(self).__name__} for '{self.db_name}' stopped: {self._error}")
+
+    def _put(self, item):
+        self._check_running()
+        self._enqueue(item)
+
+    def _enqueue(self, item):
+        # Waits for room in slices, so a writer thread that died doesn't leave the caller blocked forever
+        while True:
+            self._check_alive()
+            try:
+                self._queue.put(item, timeout=self._POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def flush(self, timeout=None):
+        """
+        Blocks until everything queued before this call has been committed. Returns False on timeout.
+        Raises RuntimeError if the writer thread has stopped.
+        """
+        if self.closed:
+            return True
+        done = Event()
+        deadline = None if timeout is None else monotonic() + timeout
+        self._put(done)
+        while not done.wait(self._POLL_INTERVAL):
+            self._check_alive()
+            if deadline is not None and monotonic() >= deadline:
+                return False
+        return True
+
+    def close(self):
+        """Commits everything pending, stops the writer thread and closes the connection."""
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        try:
+            self._enqueue(self._STOP)
+        except RuntimeError:
+            # The thread has stopped already, and closed the connection
+            return
+        self._thread.join()
+
+    def _connect(self):
+        # Only the writer thread uses it once the thread has started
+        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        # WAL lets readers (and other sessions) work while we write, without blocking on each other
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        return conn
+
+    def _write_batch(self, conn, items):
+        """Writes and commits one batch of queued items (never empty). Runs on the writer thread."""
+        raise NotImplementedError
+
+    def _run(self):
+        try:
+            self._serve(self._conn)
+        except Exception as e:
+            self._error = e
+            print(f"The {type(self).__name__} for '{self.db_name}' stopped: {e}")
+        finally:
+            self._conn.close()
+
+    def _serve(self, conn):
+        while True:
+            # Block for the first item, then keep collecting until the batch is full, flush_interval
+            # has passed, or someone is waiting for a flush
+            batch = [self._queue.get()]
+            deadline = monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not self._STOP and not isinstance(batch[-1], Event):
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is self._STOP
+            waiting = [item for item in batch if isinstance(item, Event)]
+            items = [item for item in batch if item is not self._STOP and not isinstance(item, Event)]
+            if items:
+                self._write_batch(conn, items)
+
+            for done in waiting:
+                done.set()
+
+            if stop:
+                return
+
+
+class DatabaseWriter(BatchWriter):
+    """
+    Applies queued writes to a SQLite database in batches, on a background thread (see BatchWriter).
+    Callers only pay for a queue put, so commits (and their fsyncs) never run on the polling thread.
+
+    Parameters:
+        db_name (str): Path of the SQLite database.
+        batch_size (int): Maximum number of queued operations committed in one transaction. Default: 500
+        flush_interval (float): Maximum time in seconds a write may wait before being committed. Default: 1.0
+        synchronous (str): SQLite synchronous pragma. NORMAL is durable with WAL except on power loss. Default: "NORMAL"
+    """
+    def __init__(self, db_name, batch_size=500, flush_interval=1.0, synchronous="NORMAL"):
+        self.failed_operations = 0
+        super().__init__(db_name, batch_size, flush_interval, synchronous)
+
+    def execute(self, sql, params=()):
+        """Queues a single statement."""
+        self.call(lambda conn: conn.execute(sql, params))
+
+    def executemany(self, sql, seq_of_params):
+        """Queues a statement to be run once for every parameter tuple."""
+        rows = list(seq_of_params)
+        self.call(lambda conn: conn.executemany(sql, rows))
+
+    def call(self, function):
+        """Queues function(conn), run on the writer thread inside the current batch transaction."""
+        self._put(function)
+
+    def _connect(self):
+        conn = super()._connect()
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def _write_batch(self, conn, operations):
+        for operation in operations:
+            try:
+                operation(conn)
+            except Exception as e:
+                self.failed_operations += 1
+                print(f"An error occurred while writing to the database: {e}")
+        try:
+            conn.commit()
+            self.committed_batches += 1
+        except sqlite3.Error as e:
+            print(f"An error occurred while committing to the database: {e}")
+
+
+def create_training_data_table(conn):
+    """
+    Creates the table gather_samples and convert_to_sqlite write training inputs to.
+    An input is identified by (timestamp, label, class), which is UNIQUE so re-imports can INSERT OR IGNORE.
+    Tables created before the constraint existed get it on the first call, unless they hold duplicate inputs:
+    then nothing is deleted here, run migrate_training_data.py once to remove them.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS training_data_table "
+                 "(id INTEGER PRIMARY KEY, timestamp REAL, label TEXT, class TEXT, data BLOB)")
+    has_unique_index = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_training_data_unique'").fetchone()
+    if not has_unique_index:
+        try:
+            conn.execute(
+                "CREATE UNIQUE INDEX idx_training_data_unique ON training_data_table (timestamp, label, class)")
+        except sqlite3.IntegrityError:
+            print("WARNING: training_data_table has duplicate inputs, so re-imported inputs aren't ignored. "
+                  "Run migrate_training_data.py to remove the duplicates.")
+            return
+        # Superseded by the unique index
+        conn.execute("DROP INDEX IF EXISTS idx_training_data")
+
+
+class TrainingDataWriter(BatchWriter):
+    """
+    Writes training inputs from gather_samples to training_data_table on a background thread (see BatchWriter).
+    put() only hands the array to a bounded queue. The writer thread converts the inputs to BLOBs and inserts
+    them with executemany, one transaction per batch. Nothing is ever dropped: when the queue is full put()
+    blocks until there's room (backpressure), and how often and for how long that happened is in stats().
+
+    Parameters:
+        db_name (str): Path of the SQLite database.
+        max_queued (int): Maximum number of inputs waiting to be written. Default: 1024
+        batch_size (int): Maximum number of inputs inserted per transaction. Default: 256
+        flush_interval (float): Maximum time in seconds an input may wait before being committed. Default: 1.0
+        synchronous (str): SQLite synchronous pragma. Default: "NORMAL"
+    """
+    _INSERT = "INSERT OR IGNORE INTO training_data_table (timestamp, label, class, data) VALUES (?, ?, ?, ?)"
+
+    def __init__(self, db_name, max_queued=1024, batch_size=256, flush_interval=1.0, synchronous="NORMAL"):
+        self.queued_inputs = 0
+        self.written_inputs = 0
+        self.failed_inputs = 0
+        self.blocked_puts = 0
+        self.blocked_time = 0.
+        self.max_queue_depth = 0
+        super().__init__(db_name, batch_size, flush_interval, synchronous, max_queued)
+
+    def put(self, timestamp, label, data_class, samples):
+        """
+        Queues one training input.
+
+        Parameters:
+        timestamp (float): Seconds since the epoch.
+        label (str): The label for the data. For example, "doing_math"
+        data_class (str): The class for the data. For example, "doing_math" vs "not_doing_math".
+        samples (np.ndarray): The input, e.g. (samples_per_input, 808). Must not be modified after the call.
+        """
+        self._check_running()
+        item = (timestamp, label, data_class, samples)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # The database can't keep up: wait for room rather than lose the input
+            self.blocked_puts += 1
+            start = monotonic()
+            self._put(item)
+            self.blocked_time += monotonic() - start
+        self.queued_inputs += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+
+    def stats(self):
+        """Returns the throughput and backpressure counters as a dict."""
+        return {
+            "queued_inputs": self.queued_inputs,
+            "written_inputs": self.written_inputs,
+            "failed_inputs": self.failed_inputs,
+            "committed_batches": self.committed_batches,
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "blocked_puts": self.blocked_puts,
+            "blocked_time": self.blocked_time,
+        }
+
+    def _connect(self):
+        conn = super()._connect()
+        create_training_data_table(conn)
+        conn.commit()
+        return conn
+
+    def _write_batch(self, conn, inputs):
+        try:
+            # Flattened to 1d, like convert_to_sqlite stores the legacy .npy inputs
+            conn.executemany(self._INSERT, (
+                (timestamp, label, data_class, np.ascontiguousarray(samples, dtype=np.float64).tobytes())
+                for timestamp, label, data_class, samples in inputs
+            ))
+            conn.commit()
+            self.written_inputs += len(inputs)
+            self.committed_batches += 1
+        except Exception as e:
+            conn.rollback()
+            self.failed_inputs += len(inputs)
+            print(f"An error occurred while writing training data to the database: {e}")
@@ -0,0 +1,172 @@
+"""
+Exports training_data_table to one contiguous array file that TrainingDataset memory-maps, so models can be trained
+on more data than fits in RAM without deserializing BLOBs (or opening thousands of .npy files) per sample.
+
+    <prefix>.npy        float32 (num_inputs, samples_per_input, 808), NeurosityVectorizer.export_np layout
+    <prefix>.index.npz  timestamp, label and class of every input
+
+Legacy training_data/ folders can be imported into the database first with NeurosityVectorizer.convert_to_sqlite.
+
+Usage:
+    python dataset_class.py training_data.db training_set [--dtype float32]
+"""
+import argparse
+import sqlite3
+from collections import Counter
+
+import numpy as np
+
+from neurosity_class import VECTOR_SECTIONS
+
+
+def export_training_data(db_name, prefix, dtype=np.float32, batch_size=1000):
+    """
+    Writes every input in training_data_table to <prefix>.npy and <prefix>.index.npz, ordered by timestamp.
+
+    Parameters:
+        db_name (str): Path of the SQLite database.
+        prefix (str): Path of the output files, without extension.
+        dtype: dtype of the exported array. Default: float32 (half the size of the float64 BLOBs)
+        batch_size (int): Rows read from the database at a time. Default: 1000
+
+    Returns:
+        str: Path of the array file.
+    """
+    conn = sqlite3.connect(db_name)
+    # Inputs are flattened (samples_per_input, 808) float64 BLOBs. All inputs of a dataset should be the same
+    # length (see validate_samples), any others are left out.
+    lengths = Counter(length for (length,) in conn.execute("SELECT length(data) FROM training_data_table"))
+    if not lengths:
+        raise ValueError(f"No training data in '{db_name}'")
+    length = lengths.most_common(1)[0][0]
+    if length % (808 * 8):
+        raise ValueError(f"Training data BLOBs of {length} bytes don't hold whole 808-vectors")
+    skipped = sum(lengths.values()) - lengths[length]
+    if skipped:
+        print(f"WARNING: skipping {skipped} inputs with a different number of samples")
+
+    num_inputs = lengths[length]
+    samples_per_input = length // (808 * 8)
+    data = np.lib.format.open_memmap(f"{prefix}.npy", mode="w+", dtype=dtype,
+                                     shape=(num_inputs, samples_per_input, 808))
+    timestamps = np.empty(num_inputs)
+    labels = []
+    classes = []
+
+    # Keyset pagination, so only batch_size BLOBs are in memory at a time
+    select = ("SELECT timestamp, id, label, class, data FROM training_data_table WHERE length(data) = ? "
+              "AND (timestamp, id) > (?, ?) ORDER BY timestamp, id LIMIT ?")
+    position = 0
+    last = (-np.inf, -1)
+    while True:
+        rows = conn.execute(select, (length, *last, batch_size)).fetchall()
+        if not rows:
+            break
+        last = rows[-1][:2]
+        for timestamp, _, label, data_class, blob in rows:
+            data[position] = np.frombuffer(blob).reshape(samples_per_input, 808)
+            timestamps[position] = timestamp
+            labels.append(label)
+            classes.append(data_class)
+            position += 1
+        print(f"Exported {position}/{num_inputs} inputs")
+    conn.close()
+
+    data.flush()
+    del data
+    np.savez(f"{prefix}.index.npz", timestamp=timestamps, label=np.array(labels, dtype=str),
+             data_class=np.array(classes, dtype=str))
+    return f"{prefix}.npy"
+
+
+class TrainingDataset:
+    """
+    Mini-batches from a dataset written by export_training_data. The array file is memory-mapped, so only the
+    batches being used are read from disk.
+
+    Usage:
+        dataset = TrainingDataset("training_set", batch_size=64, label="doing_math")
+        for epoch in range(10):
+            for inputs, classes in dataset:
+                psd = dataset.section(inputs, "psd")  # (64, samples_per_input, 8, 64) view
+                ...
+
+    Parameters:
+        prefix (str): The prefix passed to export_training_data.
+        batch_size (int): Inputs per batch. Default: 32
+        shuffle (bool): Visit the inputs in a new random order every epoch. Each batch is then gathered into a
+            reused buffer, which is the one copy made. If False, batches are zero-copy views of the file. Default: True
+        label (str): Only use the inputs of this label. Default: None (all inputs)
+        drop_last (bool): Leave out the last batch if it's smaller than batch_size. Default: False
+        seed (int): Seed for the shuffling. Default: None
+    """
+    def __init__(self, prefix, batch_size=32, shuffle=True, label=None, drop_last=False, seed=None):
+        self.data = np.load(f"{prefix}.npy", mmap_mode="r")
+        with np.load(f"{prefix}.index.npz") as index:
+            self.timestamps = index["timestamp"]
+            self.labels = index["label"]
+            self.classes = index["data_class"]
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.rng = np.random.default_rng(seed)
+
+        if label is None:
+            self.indices = np.arange(len(self.data))
+        else:
+            self.indices = np.flatnonzero(self.labels == label)
+        # Unshuffled batches can only be views if the inputs are contiguous
+        self.contiguous = len(self.indices) == 0 or \
+            self.indices[-1] - self.indices[0] + 1 == len(self.indices)
+        self.class_names, self.class_ids = np.unique(self.classes[self.indices], return_inverse=True)
+        self._buffer = None
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.indices) // self.batch_size
+        return -(-len(self.indices) // self.batch_size)
+
+    def __iter__(self):
+        """
+        Yields (inputs, class_ids) batches: inputs is (batch, samples_per_input, 808), class_ids indexes class_names.
+        With shuffle=True the inputs array is overwritten by the next batch, copy it if it has to be kept.
+        """
+        order = self.rng.permutation(len(self.indices)) if self.shuffle else None
+        for batch in range(len(self)):
+            start = batch * self.batch_size
+            stop = min(start + self.batch_size, len(self.indices))
+            if order is None:
+                positions = slice(start, stop)
+                if self.contiguous:
+                    first = self.indices[0]
+                    yield self.data[first + start:first + stop], self.class_ids[positions]
+                else:
+                    yield self.data[self.indices[positions]], self.class_ids[positions]
+                continue
+
+            # Sorted, so the reads from the file go forwards
+            positions = np.sort(order[start:stop])
+            if self._buffer is None:
+                self._buffer = np.empty((self.batch_size,) + self.data.shape[1:], dtype=self.data.dtype)
+            inputs = self._buffer[:stop - start]
+            np.take(self.data, self.indices[positions], axis=0, out=inputs)
+            yield inputs, self.class_ids[positions]
+
+    @staticmethod
+    def section(inputs, stream):
+        """
+        Returns a view of one stream's part of the 808-vectors, in the stream's own shape, e.g. "psd" gives
+        (..., 8, 64) and "power_by_band" (..., 5, 8). See VECTOR_SECTIONS.
+        """
+        start, stop, shape = VECTOR_SECTIONS[stream]
+        return inputs[..., start:stop].reshape(inputs.shape[:-1] + shape)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db_name")
+    parser.add_argument("prefix")
+    parser.add_argument("--dtype", default="float32", choices=["float16", "float32", "float64"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    export_training_data(args.db_name, args.prefix, np.dtype(args.dtype), args.batch_size)
@@ -0,0 +1,89 @@
+import numpy as np
+
+from blob_codec import FLAG_ZLIB, decode_array, decode_header, is_encoded
+
+
+BLOB_COLUMNS = ["psd", "alpha", "beta", "delta", "gamma", "theta"]
+# Shapes of the vectors written before BLOBs carried their own shape (see blob_codec)
+LEGACY_BLOB_SHAPES = {"psd": (8, 26), "alpha": (8,), "beta": (8,), "delta": (8,), "gamma": (8,), "theta": (8,)}
+SCALAR_COLUMNS = ["song_id", "timestamp", "focus_score", "calm_score", "user_id", "year", "month", "day", "weekday", "hour"]
+
+
+def decode_blob_column(blobs, legacy_dtype=np.float64, values_per_row=0):
+    """
+    Decodes a column of vector BLOBs (see blob_codec) into one 2-D array (N, values per row), flattening each row.
+    When every row has the same length and header, the joined bytes are decoded with a single frombuffer
+    (through a structured dtype that skips each row's header) instead of one call per row. Otherwise rows are
+    decoded one by one and shorter rows are padded with NaN.
+    An empty column decodes to shape (0, values_per_row), so results of different queries can still be stacked.
+    """
+    if len(blobs) == 0:
+        return np.empty((0, values_per_row), dtype=legacy_dtype)
+    try:
+        lengths = set(map(len, blobs))
+    except TypeError:
+        # NULL blobs
+        lengths = None
+
+    if lengths is not None and len(lengths) == 1:
+        length = lengths.pop()
+        first = blobs[0]
+        if not is_encoded(first):
+            if all(not is_encoded(blob) for blob in blobs):
+                return np.frombuffer(b"".join(blobs), dtype=legacy_dtype).reshape(len(blobs), -1)
+        else:
+            _, dtype, flags, shape, offset = decode_header(first)
+            header = bytes(first[:offset])
+            if not flags & FLAG_ZLIB and all(blob[:offset] == header for blob in blobs):
+                values = (length - offset) // dtype.itemsize
+                row = np.dtype([("header", f"V{offset}"), ("values", dtype, (values,))])
+                return np.frombuffer(b"".join(blobs), dtype=row)["values"]
+
+    rows = [decode_array(blob).ravel() if blob is not None else np.empty(0) for blob in blobs]
+    out = np.full((len(rows), max((len(row) for row in rows), default=0)), np.nan)
+    for i, row in enumerate(rows):
+        out[i, :len(row)] = row
+    return out
+
+
+def load_eeg_metrics(conn, song_ids=None, user_id=None, as_dataframe=False):
+    """
+    Bulk loads eeg_metrics rows in one query and decodes every BLOB column in a single pass.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database.
+        song_ids (list): Only load rows for these songs. Default: None (all songs)
+        user_id (str): Only load rows for this user. Default: None (all users)
+        as_dataframe (bool): Return a pandas DataFrame (vector columns hold per-row views into the
+            stacked arrays) instead of a dict of arrays. Default: False
+
+    Returns:
+        dict: "psd" (N, 208), "alpha".."theta" (N, 8) and one (N,) array per scalar column, or a DataFrame.
+            Vectors are flattened per row and keep their stored dtype (float32 for new rows, float64 for legacy ones).
+    """
+    query = f"SELECT {', '.join(SCALAR_COLUMNS + BLOB_COLUMNS)} FROM eeg_metrics"
+    conditions, params = [], []
+    if song_ids is not None:
+        song_ids = list(song_ids)
+        conditions.append(f"song_id IN ({', '.join('?' * len(song_ids))})")
+        params.extend(song_ids)
+    if user_id is not None:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    rows = conn.execute(query, params).fetchall()
+    columns = list(zip(*rows)) if rows else [()] * (len(SCALAR_COLUMNS) + len(BLOB_COLUMNS))
+
+    data = {}
+    for name, values in zip(SCALAR_COLUMNS, columns):
+        # float64 for the scores so missing values become NaN
+        data[name] = np.array(values, dtype=np.float64 if name in ("focus_score", "calm_score") else None)
+    for name, blobs in zip(BLOB_COLUMNS, columns[len(SCALAR_COLUMNS):]):
+        data[name] = decode_blob_column(blobs, values_per_row=int(np.prod(LEGACY_BLOB_SHAPES[name])))
+
+    if as_dataframe:
+        import pandas as pd
+        return pd.DataFrame({name: list(values) if values.ndim > 1 else values for name, values in data.items()})
+    return data
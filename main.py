@@ -1,118 +1,254 @@
-import spotipy
-from dotenv import load_dotenv, dotenv_values
-from neurosity import NeurositySDK
-from spotipy.oauth2 import SpotifyOAuth
-import requests
-import sqlite3
-from datetime import datetime
+from time import monotonic
+STARTED = monotonic()
+
+import argparse
+from dotenv import load_dotenv
 import os
 from neurosity_class import NeurosityVectorizer
 from spotify_class import SpotifyAPI
-import numpy as np
-import time
-
-
-
-
-load_dotenv("environment.env")
+from playback_class import PlaybackMonitor
+from scheduler_class import SampleScheduler
+import signal
+import threading
 
 
+DB = "music.db"
 
-
-# get the secret from the environment
-SPOTIFY_SECRET = os.getenv("SPOTIFY_SECRET")
-SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
-
-email = os.environ.get('NEUROSITY_EMAIL')
-password = os.environ.get("NEUROSITY_PASSWORD")
-device_id = os.environ.get("NEUROSITY_DEVICE_ID")
-
-
-neurosity = NeurositySDK({
-    "device_id": device_id})
-neurosity.login({
-    "email": email,
-    "password": password})
+# Seconds from process start until EEG is being collected. A supervisor restarts this script after a crash,
+# so a slower startup is data lost every time.
+STARTUP_BUDGET = 5.0
 
 
+def connect_neurosity():
+    """Logs in to Neurosity with the credentials from environment.env and returns the SDK client."""
+    from neurosity import NeurositySDK
 
-DB = "music.db"
+    neurosity = NeurositySDK({
+        "device_id": os.environ.get("NEUROSITY_DEVICE_ID")})
+    neurosity.login({
+        "email": os.environ.get("NEUROSITY_EMAIL"),
+        "password": os.environ.get("NEUROSITY_PASSWORD")})
+    return neurosity
 
 
-spotify_api = SpotifyAPI(SPOTIFY_CLIENT_ID, SPOTIFY_SECRET)
-neurosity_vectorizer = NeurosityVectorizer(neurosity)
+def device_can_save(neurosity_vectorizer):
+    return neurosity_vectorizer.status=="online" and not neurosity_vectorizer.charging
 
-# clear database
-spotify_api.clear_database(DB)
 
-# if database doesnt exist, create it
-if not os.path.exists(DB):
-    spotify_api.initialize_database(DB)
+def save_song_eeg_samples(spotify_api, neurosity_vectorizer, song_id, db_name, samples=None):
+    """
+    Queues the per-sample EEG records gathered so far for song_id (if the vectorizer records them), or the
+    samples passed in (e.g. the ones finish_song returned).
+    """
+    if samples is None:
+        samples = neurosity_vectorizer.drain_samples()
+    # Only gathered while the device could save (see on_status_change), so no status check here
+    if samples:
+        spotify_api.add_eeg_samples(song_id, samples, db_name, min_quality=neurosity_vectorizer.min_quality)
 
 
+def save_song_eeg_data(spotify_api, neurosity_vectorizer, playback_monitor, song_id, db_name):
+    """
+    Finalizes the EEG data collected for song_id and adds it to the database.
 
-def monitor_song_and_collect_data(spotify_api, neurosity_vectorizer, db_name="music_focus.db"):
+    Returns:
+        bool: True if the data was added.
+    """
+    # In one step, so frames the collector thread gathers meanwhile go to the next song instead of getting lost
+    eeg_dict, samples = neurosity_vectorizer.finish_song()
+    save_song_eeg_samples(spotify_api, neurosity_vectorizer, song_id, db_name, samples)
+
+    # Wait for the song to be resolved (normally long done) so its row exists before the EEG row
+    song_metrics = playback_monitor.get_song_metrics(song_id)
+
+    # Whether the device is online now doesn't matter, collection was paused while it couldn't save. A song is
+    # saved if any EEG was collected for it.
+    if song_metrics is None:
+        print("EEG data not added - Song metrics could not be resolved")
+    elif not song_id:
+        print("EEG data not added - No song playing")
+    elif eeg_dict["sample_count"] == 0:
+        print("EEG data not added - No EEG collected (device offline, charging or with bad contact)")
+    else:
+        # Add the EEG data to the database for the song
+        spotify_api.add_eeg_metrics(song_id, eeg_dict, db_name)
+        return True
+    return False
+
+
+def monitor_song_and_collect_data(spotify_api, neurosity_vectorizer, db_name="music_focus.db", sample_interval=1/4,
+                                  stop_event=None, max_songs=None, sample_batch_size=64):
     """
     Monitors the currently playing song on Spotify, collects EEG data while the song is playing,
     and saves the collected data to the database when the song ends or is skipped.
+    Keeps recording song after song until stop_event is set (or max_songs songs are done), so one process
+    can cover a whole listening session. While playback is paused or stopped no EEG is collected,
+    and the song's data is kept until a different song starts.
+    Spotify is polled on a background thread (PlaybackMonitor), so EEG sampling keeps its cadence
+    no matter how long the API takes to respond.
 
     Args:
         spotify_api (SpotifyAPI): Instance of the SpotifyAPI class.
         neurosity_vectorizer (NeurosityVectorizer): Instance of the NeurosityVectorizer class.
         db_name (str): Name of the SQLite database.
+        sample_interval (float): Seconds between EEG samples.
+        stop_event (threading.Event): Set it to end the session. The song playing at that point is saved.
+        max_songs (int): Stop after this many songs. Default: None (run until stop_event is set)
+        sample_batch_size (int): Per-sample EEG records are written in batches of this size.
+
+    Returns:
+        list: IDs of the songs whose EEG data was added to the database.
+    """
+    stop_event = stop_event or threading.Event()
+    playback_monitor = PlaybackMonitor(spotify_api, db_name=db_name).start()
+
+    def on_status_change(old, new):
+        # Pushed by the device (on the SDK's thread): pause collecting as soon as it goes offline or starts
+        # charging, and resume when it's back, if a song is playing. The loop below would only see it a tick later.
+        if not device_can_save(neurosity_vectorizer):
+            neurosity_vectorizer.stop_recording()
+        else:
+            current_song = playback_monitor.current_track
+            if current_song is not None and current_song["is_playing"]:
+                neurosity_vectorizer.start_recording()
+    neurosity_vectorizer.status_listeners.append(on_status_change)
+
+    current_song_id = None
+    songs_finished = 0
+    saved_song_ids = []
+
+    # Absolute deadlines, so the time spent in the loop doesn't slow the sampling rate down. Waiting on the
+    # event means a stop request is handled straight away. 4 Hz doesn't need busy-waiting.
+    scheduler = SampleScheduler(interval=sample_interval, spin=0, stop_event=stop_event)
+    for _ in scheduler.ticks():
+        # Only reads the latest poll result, never waits for Spotify
+        current_song = playback_monitor.current_track
+
+        # Nothing playing, or paused: keep the current song's data but don't collect
+        if current_song is not None and current_song["is_playing"]:
+            # A different song started, finalize the previous song's data
+            if current_song["id"] != current_song_id:
+                if current_song_id is not None:
+                    if save_song_eeg_data(spotify_api, neurosity_vectorizer, playback_monitor, current_song_id, db_name):
+                        saved_song_ids.append(current_song_id)
+                    songs_finished += 1
+                    if max_songs is not None and songs_finished >= max_songs:
+                        break
+
+                current_song_id = current_song["id"]
+                print(f"Now playing: {current_song['track_name']} by {', '.join(current_song['artists'])}")
+
+            # The status is pushed by the device, so this is never stale. Nothing is collected while it's
+            # offline or charging (see on_status_change), but the song's data so far is kept.
+            if device_can_save(neurosity_vectorizer):
+                # Frames from a pause are thrown away. Event-driven, the collector thread adds every frame as it arrives.
+                neurosity_vectorizer.start_recording()
+                if not neurosity_vectorizer.event_driven:
+                    neurosity_vectorizer.gather_eeg_samples_during_song()  # Gather the EEG frames since the last tick
+                if len(neurosity_vectorizer.pending_samples) >= sample_batch_size:
+                    save_song_eeg_samples(spotify_api, neurosity_vectorizer, current_song_id, db_name)
+            else:
+                neurosity_vectorizer.stop_recording()
+        else:
+            neurosity_vectorizer.stop_recording()
+
+    neurosity_vectorizer.stop_recording()
+    # Stopped in the middle of a song: save what was collected for it
+    if stop_event.is_set() and current_song_id is not None:
+        if save_song_eeg_data(spotify_api, neurosity_vectorizer, playback_monitor, current_song_id, db_name):
+            saved_song_ids.append(current_song_id)
+
+    neurosity_vectorizer.status_listeners.remove(on_status_change)
+    playback_monitor.stop()
+    stats = scheduler.stats()
+    print(f"Sampled at {stats['achieved_rate']:.2f} Hz (target {stats['target_rate']:.2f} Hz), "
+          f"{stats['missed_ticks']} samples missed")
+    return saved_song_ids
+
+
+
+
+
+def run_session_engine(spotify_api, neurosity_vectorizer, db_name):
     """
-    first_song = spotify_api.get_current_song_metrics()
+    Runs the session on the asyncio SessionEngine (see session_class) until Ctrl+C or a termination signal.
+    The vectorizer has to be created with subscribe_gathered=False.
 
+    Returns:
+        list: IDs of the songs whose EEG data was added to the database.
+    """
+    import asyncio
+    from session_class import SessionEngine
 
-    print(f"Now playing: {first_song['track_name']} by {', '.join(first_song['artists'])}")
-    current_song_id = first_song["id"]
-    eeg_data = []
-    stop = False
-    added = False
+    async def run():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop_event.set)
+        return await SessionEngine(spotify_api, neurosity_vectorizer, db_name).run_session(stop_event)
 
-    while not stop:
-        # Get the currently playing song
-        neurosity_vectorizer.gather_eeg_samples_during_song()  # Start gathering EEG samples
+    return asyncio.run(run())
 
-        current_song = spotify_api.get_current_song_metrics() # Get the currently playing song
-        if not added:
-            spotify_api.add_song_to_database(current_song, db_name)
-            added = True
 
-        # If the song has changed, finalize the previous song's data
-        if current_song_id != current_song["id"]:
-            eeg_dict = neurosity_vectorizer.get_current_song_eeg_data()
-            neurosity_vectorizer.reset_current_song_eeg_data()
+def main():
+    parser = argparse.ArgumentParser(description="Records EEG for every song played on Spotify.")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="run the session on the asyncio SessionEngine instead of the threaded loop")
+    parser.add_argument("--clear-db", action="store_true",
+                        help="delete everything recorded so far before starting. By default it's kept, so a "
+                             "restart continues the database and the audio features cache")
+    args = parser.parse_args()
 
+    load_dotenv("environment.env")
 
-            if current_song_id and neurosity_vectorizer.status=="online" and not neurosity_vectorizer.charging:
-                # Add the EEG data to the database for the previous song
-                spotify_api.add_eeg_metrics(current_song_id, eeg_dict, db_name)
-            elif neurosity_vectorizer.status=="offline":
-                print("EEG data not added - Device is offline")
-            elif not current_song_id:
-                print("EEG data not added - No song playing")
-            elif neurosity_vectorizer.charging:
-                print("EEG data not added - Device is charging")
+    # Creating the SpotifyAPI doesn't touch the network. The user profile is fetched here, once, before the
+    # database writer starts: the rows are written with it and the writer thread never fetches it itself.
+    spotify_api = SpotifyAPI(os.getenv("SPOTIFY_CLIENT_ID"), os.getenv("SPOTIFY_SECRET"), db_name=DB)
+    spotify_api.get_current_user()
 
+    # Create the tables, or add the tables/columns/indexes an older database is missing. It only creates what
+    # isn't there yet, so it runs on every start.
+    spotify_api.initialize_database(DB)
 
-            # Update the current song ID
-            old_song_id = current_song_id
-            current_song_id = current_song["id"]
-            added = False # Reset the added flag
-            stop = True
+    if args.clear_db:
+        spotify_api.clear_database(DB)
 
-            print(f"Now playing: {current_song['track_name']} by {', '.join(current_song['artists'])}")
+    # per-song statistics are kept in memory, the individual samples go to the eeg_samples table
+    # Samples taken while fewer than half of the channels have good contact are left out, instead of redoing the song
+    # The threaded loop is event-driven (a collector thread gathers the frames), the SessionEngine gets the
+    # frames of the gathered streams on its event loop instead.
+    neurosity_vectorizer = NeurosityVectorizer(connect_neurosity(), streaming_stats=True, record_samples=True,
+                                               event_driven=not args.asyncio, monitor_quality=True, min_quality=0.5,
+                                               subscribe_gathered=not args.asyncio)
 
-        time.sleep(1/4)
-    return old_song_id
+    startup = monotonic() - STARTED
+    print(f"Started in {startup:.2f} s")
+    if startup > STARTUP_BUDGET:
+        print(f"WARNING: startup took longer than its {STARTUP_BUDGET:.1f} s budget")
 
+    if args.asyncio:
+        saved_song_ids = run_session_engine(spotify_api, neurosity_vectorizer, DB)
+    else:
+        # Run until Ctrl+C or a termination signal from the supervisor
+        stop_event = threading.Event()
+        def request_stop(signum, frame):
+            print("Stopping after the current sample...")
+            stop_event.set()
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGTERM, request_stop)
 
+        saved_song_ids = monitor_song_and_collect_data(spotify_api, neurosity_vectorizer, DB, stop_event=stop_event)
 
+    if saved_song_ids:
+        eeg_data = spotify_api.get_eeg_data_from_DB(saved_song_ids[-1], DB)
 
+    # unsubscribe from the device, flush queued writes and close the database connections
+    neurosity_vectorizer.close()
+    print("Audio features cache:", spotify_api.get_feature_cache_stats())
+    spotify_api.close()
 
-old_song_id = monitor_song_and_collect_data(spotify_api, neurosity_vectorizer, DB)
+    print(f"Data collection complete ({len(saved_song_ids)} songs)")
 
-eeg_data = spotify_api.get_eeg_data_from_DB(old_song_id, DB)
 
-print("Data collection complete")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Rewrites the legacy raw float64 vector BLOBs of an existing database (e.g. music.db) in the versioned
+format of blob_codec, which stores dtype and shape and defaults to float32 (half the size).
+Rows that are already in the versioned format are left alone, so the migration can be re-run safely.
+
+Usage:
+    python migrate_blobs.py music.db [--dtype float32] [--compress] [--vacuum]
+"""
+import argparse
+import sqlite3
+
+import numpy as np
+
+from blob_codec import VERSION, decode_array, encode_array, is_encoded
+from eeg_loader import LEGACY_BLOB_SHAPES
+
+
+# eeg_metrics vector columns and the shape their legacy BLOBs were written with
+MIGRATED_COLUMNS = dict(LEGACY_BLOB_SHAPES, **{f"{name}_var": shape for name, shape in LEGACY_BLOB_SHAPES.items()})
+
+
+def migrate_database(db_name, dtype=np.float32, compress=False, batch_size=1000, vacuum=False):
+    """
+    Re-encodes every legacy BLOB in eeg_metrics.
+
+    Parameters:
+        db_name (str): Path of the SQLite database.
+        dtype: Storage dtype for the re-encoded vectors. Default: float32
+        compress (bool): zlib-compress the re-encoded vectors. Default: False
+        batch_size (int): Rows updated per executemany/commit. Default: 1000
+        vacuum (bool): VACUUM afterwards, so the freed space is returned to the file system. Default: False
+
+    Returns:
+        int: Number of rows rewritten.
+    """
+    conn = sqlite3.connect(db_name)
+    existing_columns = {row[1] for row in conn.execute("PRAGMA table_info(eeg_metrics)")}
+    columns = [column for column in MIGRATED_COLUMNS if column in existing_columns]
+
+    select = f"SELECT rowid, {', '.join(columns)} FROM eeg_metrics WHERE rowid > ? ORDER BY rowid LIMIT ?"
+    update = f"UPDATE eeg_metrics SET {', '.join(f'{column} = ?' for column in columns)} WHERE rowid = ?"
+
+    migrated = 0
+    last_rowid = -1
+    while True:
+        # Keyset pagination, so no SELECT is left running while the rows are updated
+        rows = conn.execute(select, (last_rowid, batch_size)).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+        updates = []
+        for rowid, *blobs in rows:
+            if all(blob is None or is_encoded(blob) for blob in blobs):
+                continue
+            new_blobs = [
+                blob if blob is None or is_encoded(blob)
+                else encode_array(decode_array(blob, MIGRATED_COLUMNS[column]), dtype, compress)
+                for column, blob in zip(columns, blobs)
+            ]
+            updates.append((*new_blobs, rowid))
+        if updates:
+            conn.executemany(update, updates)
+            conn.commit()
+            migrated += len(updates)
+            print(f"Migrated {migrated} rows")
+
+    conn.execute(f"PRAGMA user_version = {VERSION}")
+    conn.commit()
+    if vacuum:
+        conn.execute("VACUUM")
+    conn.close()
+    print(f"Done migrating '{db_name}' ({migrated} rows rewritten)")
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db_name")
+    parser.add_argument("--dtype", default="float32", choices=["float16", "float32", "float64"])
+    parser.add_argument("--compress", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--vacuum", action="store_true")
+    args = parser.parse_args()
+    migrate_database(args.db_name, np.dtype(args.dtype), args.compress, args.batch_size, args.vacuum)
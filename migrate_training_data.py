@@ -0,0 +1,45 @@
+"""
+One-time migration of a training data database (e.g. training_data.db) written before training_data_table had
+its UNIQUE (timestamp, label, class) index: deletes the duplicate inputs, keeping the first copy of each, and
+creates the index. Re-running it on a migrated database changes nothing.
+
+Usage:
+    python migrate_training_data.py training_data.db [--vacuum]
+"""
+import argparse
+import sqlite3
+
+from database_class import create_training_data_table
+
+
+def deduplicate_training_data(db_name, vacuum=False):
+    """
+    Deletes duplicate inputs from training_data_table and adds the UNIQUE index.
+
+    Parameters:
+        db_name (str): Path of the SQLite database.
+        vacuum (bool): VACUUM afterwards, so the freed space is returned to the file system. Default: False
+
+    Returns:
+        int: Number of inputs deleted.
+    """
+    conn = sqlite3.connect(db_name)
+    conn.execute("CREATE TABLE IF NOT EXISTS training_data_table "
+                 "(id INTEGER PRIMARY KEY, timestamp REAL, label TEXT, class TEXT, data BLOB)")
+    deleted = conn.execute("DELETE FROM training_data_table WHERE id NOT IN "
+                           "(SELECT MIN(id) FROM training_data_table GROUP BY timestamp, label, class)").rowcount
+    create_training_data_table(conn)
+    conn.commit()
+    if vacuum:
+        conn.execute("VACUUM")
+    conn.close()
+    print(f"Done migrating '{db_name}' ({deleted} duplicate inputs deleted)")
+    return deleted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db_name")
+    parser.add_argument("--vacuum", action="store_true")
+    args = parser.parse_args()
+    deduplicate_training_data(args.db_name, args.vacuum)
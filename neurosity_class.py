@@ -1,16 +1,40 @@
 import json
+import queue
 import sqlite3
-from os import path, mkdir, listdir
-from time import sleep, time
-import requests
+from os import path
+from time import time, monotonic
+from collections import deque
+from threading import Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+import os
 
 import numpy as np
 
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-import requests
-from datetime import datetime
-import os
+from accumulator_class import GrowableArray, RunningStats
+from channel_class import FrameChannel
+from scheduler_class import SampleScheduler
+from database_class import TrainingDataWriter, create_training_data_table
+
+
+# Layout of one per-sample EEG record (see record_samples): the PSD (first 26 bins) followed by the
+# power by band, packed as float32
+SAMPLE_PSD_SHAPE = (8, 26)
+SAMPLE_BANDS_SHAPE = (5, 8)
+
+# Streams whose frames go into the per-song data (see gather_eeg_samples_during_song)
+GATHERED_STREAMS = ("psd", "power_by_band", "focus", "calm")
+# Streams in the 808-vector, in order (see VECTOR_SECTIONS and export_np)
+VECTOR_STREAMS = ("raw", "raw_unfiltered", "psd", "power_by_band")
+# Every stream with a FrameChannel
+CHANNEL_STREAMS = VECTOR_STREAMS + ("focus", "calm")
+
+# Sections of the 808-vector returned by export_np: (start, stop, shape of the stream's frame)
+VECTOR_SECTIONS = {
+    "raw": (0, 128, (8, 16)),
+    "raw_unfiltered": (128, 256, (8, 16)),
+    "psd": (256, 768, (8, 64)),
+    "power_by_band": (768, 808, (5, 8)),
+}
 
 
 
@@ -18,11 +42,76 @@ import os
 
 
 
+# Segments of the 808-vector that export_images min-max scales separately (the image only uses the first 800 values)
+IMAGE_SEGMENTS = ((0, 128), (128, 256), (256, 768), (768, 800))
+
+
+def export_images(vectors):
+    """
+    Turns 808-vectors (e.g. from sample() or a session in the database) into 40x20 grayscale heatmaps in one pass.
+    The vectors are cut to their first 800 values and every segment (raw, raw unfiltered, psd, power by band) is
+    min-max scaled to [0, 1] per vector. A segment whose values are all the same becomes 0 instead of NaN.
+
+    Parameters:
+    vectors (np.ndarray): (N, 808) array.
+
+    Returns:
+    np.ndarray: (N, 40, 20) float64 image stack.
+    """
+    vectors = np.asarray(vectors)
+    if vectors.ndim != 2 or vectors.shape[1] != 808:
+        raise ValueError(f"Expected an (N, 808) array, got {vectors.shape}")
+    images = np.array(vectors[:, 0:800], dtype=np.float64)
+    for start, stop in IMAGE_SEGMENTS:
+        segment = images[:, start:stop]
+        low = segment.min(axis=1, keepdims=True)
+        value_range = segment.max(axis=1, keepdims=True) - low
+        segment -= low
+        np.divide(segment, value_range, out=segment, where=value_range > 0)
+    return images.reshape(-1, 40, 20)
+
+
+def read_npy_shape(file_path):
+    """Reads the shape of a .npy file from its header, without reading the data. Returns None if it isn't a valid .npy file."""
+    try:
+        with open(file_path, "rb") as f:
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, _, _ = read_header(f)
+        return list(shape)
+    except (OSError, ValueError):
+        return None
+
+
 class NeurosityVectorizer:
     """
     This class is used to vectorize the data from the Neurosity hardware or a simulator
+
+    Parameters:
+        simulator: The Neurosity SDK instance (or a simulator with the same subscription methods).
+        streaming_stats (bool): If True, per-song data is folded into running statistics (Welford mean/variance,
+            min/max, count) instead of being stored sample by sample, so per-song memory is O(1). Default: False
+        reservoir_size (int): Only used with streaming_stats. Size of the reservoir sample kept for
+            approximate quantiles. Default: 0 (no quantiles)
+        record_samples (bool): If True, every sample gathered during a song is also kept as a timestamped,
+            packed float32 record until drain_samples() is called, so the time series can be stored. Default: False
+        event_driven (bool): If True, a collector thread adds every PSD, power by band, focus and calm frame to the
+            current song's data as soon as it arrives (while recording, see start_recording), instead of waiting for
+            gather_eeg_samples_during_song to be called. The stream callbacks only wake it up. Default: False
+        channel_size (int): Frames of each stream that can wait to be gathered (see FrameChannel). When it is
+            full the oldest frame is dropped and counted in get_channel_stats. Default: 64
+        monitor_quality (bool): If True, the signal quality is followed for as long as the vectorizer exists. Every
+            frame is tagged with the quality score (see quality_score) of the latest reading when it arrives, and
+            every per-sample record with its PSD frame's. Default: False
+        min_quality (float): With monitor_quality, frames that arrive while the quality score is below this are
+            left out of the per-song statistics (excluded_frames counts the PSD frames). Their per-sample records are still
+            kept, tagged, so SpotifyAPI.add_eeg_samples can filter them. Default: None (keep everything)
+        subscribe_gathered (bool): If False, the vectorizer doesn't subscribe to the PSD, power by band, focus and
+            calm streams itself. Whoever does has to pass their frames to the update_* methods, like
+            session_class.SessionEngine does from its event loop. Default: True
     """
-    def __init__(self, simulator):
+    def __init__(self, simulator, streaming_stats=False, reservoir_size=0, record_samples=False, event_driven=False,
+                 channel_size=64, monitor_quality=False, min_quality=None, subscribe_gathered=True):
         self.simulator = simulator
         self.latest_raw = None
         self.latest_raw_unfiltered = None
@@ -31,50 +120,234 @@ class NeurosityVectorizer:
         self.latest_focus = None
         self.latest_calm = None
 
+        # The update_* callbacks only put each frame into its stream's bounded channel, so the SDK threads never
+        # wait for a lock or a reader. export_np copies the newest frames into slices of one preallocated
+        # 808-vector, and gather_eeg_samples_during_song consumes the psd/power by band/focus/calm channels.
+        self.channels = {stream: FrameChannel(channel_size) for stream in CHANNEL_STREAMS}
+        self._vector = np.zeros(808)
+        self._vector_sections = {
+            stream: self._vector[start:stop].reshape(shape) for stream, (start, stop, shape) in VECTOR_SECTIONS.items()
+        }
+        self._vector_seq = {stream: 0 for stream in VECTOR_SECTIONS}
+        # Serialises the export_np callers, which share _vector. The callbacks never take it.
+        self._export_lock = Lock()
+
+        # Timing stats (see SampleScheduler.stats) of the last gather_samples/sample run
+        self.last_sampling_stats = None
+
+        # Per-song accumulators. GrowableArray keeps every sample (grown by doubling so each tick is an O(1) copy),
+        # RunningStats only keeps the statistics. Both have the same append/mean/var/reset interface.
+        self.streaming_stats = streaming_stats
+        if streaming_stats:
+            self.current_song_psd = RunningStats((8, 26), reservoir_size)
+            self.current_song_power_by_band = RunningStats((5, 8), reservoir_size)
+            self.current_song_focus = RunningStats((), reservoir_size)
+            self.current_song_calm = RunningStats((), reservoir_size)
+        else:
+            self.current_song_psd = GrowableArray((8, 26))
+            self.current_song_power_by_band = GrowableArray((5, 8))
+            self.current_song_focus = GrowableArray()
+            self.current_song_calm = GrowableArray()
+
+        # Per-sample records waiting to be written: (seconds since song start, packed blob, focus, calm, quality)
+        self.record_samples = record_samples
+        self.pending_samples = []
+        self.current_song_start = None
+
+        # Guards the accumulators, pending_samples and the draining of the gathered channels. Only the readers
+        # (gather_eeg_samples_during_song, drain_samples, ...) take it, never the stream callbacks.
+        self._song_lock = Lock()
+        self.event_driven = event_driven
+        self.recording = False
+
+        # Gathered frames not yet paired into a per-sample record, see _pair_samples. A PSD frame waits at most
+        # pair_timeout seconds for the power by band/focus/calm frames that arrive after it.
+        self._unpaired = {stream: deque() for stream in GATHERED_STREAMS}
+        self.pair_timeout = 0.5
+
+        # Event-driven: the callbacks put a wake-up here (SimpleQueue.put never blocks) and the collector thread
+        # gathers the frames
+        self._wakeups = queue.SimpleQueue()
+        self._closed = False
+        self._collector = None
+        if event_driven:
+            self._collector = Thread(target=self._collect, name="NeurosityVectorizer collector", daemon=True)
+            self._collector.start()
+
+        # Signal quality: (time, score, number of bad channels) of the latest reading, see update_signal_quality
+        self.quality = None
+        self.min_quality = min_quality
+        self.excluded_frames = 0
+        self.max_bad_channels = 3
+
         # Subscribe to all data streams
-        self.simulator.brainwaves_raw(self.update_raw)  # Shape: (8, 16)
-        self.simulator.brainwaves_raw_unfiltered(self.update_raw_unfiltered)  # Shape: (8, 16)
-        self.simulator.brainwaves_psd(self.update_psd)  # Shape: (8, 64)
-        self.simulator.brainwaves_power_by_band(self.update_power_by_band)  # Shape: (5, 8)
-        self.simulator.focus(self.update_focus)  # Shape: (1, 1)
-        self.simulator.calm(self.update_calm)  # Shape: (1, 1)
-
-        # Quality bool
+        self.subscribe_gathered = subscribe_gathered
+        self.unsubscribes = [
+            self.simulator.brainwaves_raw(self.update_raw),  # Shape: (8, 16)
+            self.simulator.brainwaves_raw_unfiltered(self.update_raw_unfiltered),  # Shape: (8, 16)
+        ]
+        if subscribe_gathered:
+            self.unsubscribes += [
+                self.simulator.brainwaves_psd(self.update_psd),  # Shape: (8, 64)
+                self.simulator.brainwaves_power_by_band(self.update_power_by_band),  # Shape: (5, 8)
+                self.simulator.focus(self.update_focus),  # Shape: (1, 1)
+                self.simulator.calm(self.update_calm),  # Shape: (1, 1)
+            ]
+        self.quality_unsub = self.simulator.signal_quality(self.update_signal_quality) if monitor_quality else None
+
+        # Set by ensure_quality
         self.quality_met = False
-        self.max_fails = 3
-        self.status = self.get_status()["state"] # online or offline
-        self.charging =  self.get_status()["charging"] # True or False
 
-        self.current_song_psd = np.zeros((0,8,26))
-        self.current_song_power_by_band = np.zeros((0,5,8))
-        self.current_song_focus = np.array([])
-        self.current_song_calm = np.array([])
+        # Device status. One status_once round trip to start with, then the status subscription keeps it current,
+        # so reading it never goes to the network. Functions in status_listeners are called with
+        # (old status, new status) when the state or charging changes (on the SDK's thread).
+        self.status_listeners = []
+        self.device_status = None
+        self.status_updated = None
+        self.status = None  # online or offline
+        self.charging = None  # True or False
+        self.update_status(self.simulator.status_once())
+        self.status_unsub = self.simulator.status(self.update_status)
 
         # sleep(1.5) # to get 808 vectors straight away
 
-    def get_status(self):
-        return self.simulator.status_once()
+    def close(self):
+        """Unsubscribes from the device and stops the collector thread. Gather or drain the song's data first."""
+        for unsubscribe in self.unsubscribes:
+            unsubscribe()
+        self.unsubscribes = []
+        if self.status_unsub is not None:
+            self.status_unsub()
+            self.status_unsub = None
+        if self.quality_unsub is not None:
+            self.quality_unsub()
+            self.quality_unsub = None
+        self.recording = False
+        self._closed = True
+        if self._collector is not None:
+            self._wakeups.put(None)
+            self._collector.join()
+            self._collector = None
+
+    def get_status(self, refresh=False):
+        """
+        Returns the device status (a dict with "state", "charging", ...) as last pushed by the device.
+
+        Parameters:
+        refresh (bool): Ask the device (a network round trip) instead of using the cached status. Default: False
+        """
+        if refresh:
+            self.update_status(self.simulator.status_once())
+        return self.device_status
+
+    def get_status_age(self):
+        """Seconds since the status was last updated."""
+        return monotonic() - self.status_updated
+
+    def update_status(self, data):
+        old = self.device_status
+        self.device_status = data
+        self.status_updated = monotonic()
+        self.status = data["state"]
+        self.charging = data.get("charging", False)
+        if old is not None and (old["state"], old.get("charging", False)) != (self.status, self.charging):
+            print(f"Device status changed: {old['state']} -> {self.status}"
+                  f"{' (charging)' if self.charging else ''}")
+            for listener in list(self.status_listeners):
+                listener(old, data)
 
     def update_raw(self, data):
         # self.latest_raw = np.array(data['data'])
         self.latest_raw = data['data']
+        self._frame_received("raw", data['data'])
     def update_raw_unfiltered(self, data):
         # self.latest_raw_unfiltered = np.array(data['data'])
         self.latest_raw_unfiltered = data['data']
+        self._frame_received("raw_unfiltered", data['data'])
     def update_psd(self, data):
         # self.latest_psd = np.array(data['psd'])
         self.latest_psd = data['psd']
+        self._frame_received("psd", self.latest_psd)
     def update_power_by_band(self, data):
         # self.latest_power_by_band = np.array(list(data['data'].values()))
         self.latest_power_by_band = list(data['data'].values())
+        self._frame_received("power_by_band", self.latest_power_by_band)
 
     def update_focus(self, data):
         self.latest_focus = data["probability"]
+        self._frame_received("focus", self.latest_focus)
 
     def update_calm(self, data):
         self.latest_calm = data["probability"]
+        self._frame_received("calm", self.latest_calm)
+
+    def _frame_received(self, stream, frame):
+        # Runs on the stream's SDK thread, the channel's only producer. The conversion happens here rather
+        # than in the readers.
+        if stream in VECTOR_SECTIONS:
+            frame = np.asarray(frame, dtype=np.float64)
+            if frame.shape != VECTOR_SECTIONS[stream][2]:
+                # Drop it rather than export a vector with a wrong-shaped frame in it
+                print(f"WARNING: {stream} frame has an unexpected shape (expected {VECTOR_SECTIONS[stream][2]})")
+                return
+        # Tagged with the quality score now, the reader may only get to the frame after the next reading
+        quality = self.quality
+        self.channels[stream].put(frame, quality[1] if quality is not None else None)
+        if self.event_driven and stream in GATHERED_STREAMS:
+            self._wakeups.put(None)
+
+    def _collect(self):
+        # Event-driven collector thread, the only reader of the gathered channels besides the *_recording calls
+        while True:
+            self._wakeups.get()
+            if self._closed:
+                return
+            if self.recording:
+                self.gather_eeg_samples_during_song()
+
+    def start_recording(self):
+        """
+        Frames that arrive from now on are added to the current song (e.g. playback started). Frames still waiting
+        from before (e.g. from a pause) are thrown away. Event-driven mode gathers them as they arrive while recording.
+        """
+        if self.recording:
+            return
+        with self._song_lock:
+            for stream in GATHERED_STREAMS:
+                self.channels[stream].discard()
+                self._unpaired[stream].clear()
+            self.recording = True
 
-    def export_np(self):
+    def stop_recording(self):
+        """
+        Frames that arrive from now on aren't gathered (e.g. playback paused). The ones that arrived while recording
+        are gathered first. The song's data is kept.
+        """
+        if not self.recording:
+            return
+        self.recording = False
+        self.gather_eeg_samples_during_song()
+
+    def snapshot(self, streams=CHANNEL_STREAMS):
+        """
+        The newest frame of every stream, read without locking. If a stream gets a new frame while the others are
+        being read, the snapshot is retaken, so the frames were all current at the same moment.
+
+        Returns:
+        dict: stream -> (sequence number, arrival time, frame, quality score), or None for a stream that hasn't sent a
+            frame yet.
+        """
+        for _ in range(10):
+            frames = {stream: self.channels[stream].latest() for stream in streams}
+            if all(self.channels[stream].latest() is frame for stream, frame in frames.items()):
+                break
+        return frames
+
+    def get_channel_stats(self):
+        """Returns the FrameChannel.stats (sent, received, dropped, ...) of every stream."""
+        return {stream: channel.stats() for stream, channel in self.channels.items()}
+
+    def export_np(self, out=None, copy=True):
         """
         Returns all the latest data as a single numpy array.
         The array is in the shape (808,)
@@ -83,26 +356,36 @@ class NeurosityVectorizer:
         128:256 - raw unfiltered
         256:768 - psd
         768:808 - power by band
+
+        The newest frames of the four streams are taken as one consistent snapshot and copied into a preallocated
+        buffer (only the sections with a new frame since the last call).
+        Returns None (with a warning) until every stream has delivered a frame.
+
+        Parameters:
+        out (np.ndarray): Optional (808,) array to copy the vector into instead of allocating a new one.
+        copy (bool): If False, returns a read-only view of the internal buffer. No allocation at all, but the view
+            is overwritten by the next export_np call. Default: True
         """
-        # Convert to numpy arrays
-        latest_raw = np.array(self.latest_raw)
-        latest_raw_unfiltered = np.array(self.latest_raw_unfiltered)
-        latest_psd = np.array(self.latest_psd)
-        latest_power_by_band = np.array(self.latest_power_by_band)
-        # print("latest_raw", len(latest_raw))
-        # print("latest_raw_unfiltered", len(latest_raw_unfiltered))
-        # print("latest_psd", len(latest_psd))
-        # print("latest_power_by_band", len(latest_power_by_band))
-        # print("sum of lengths", len(latest_raw) + len(latest_raw_unfiltered) + len(latest_psd) + len(latest_power_by_band))
-
-        # Concatenate and flatten all the latest data
-        all_data = [latest_raw, latest_raw_unfiltered, latest_psd, latest_power_by_band]
-        vector_808 = np.concatenate([data.flatten() for data in all_data if data is not None])
-        if len(vector_808) != 808:
-            print(f"WARNING: vector_808 is not 808 long (length: {len(vector_808)})")
-            return
-        elif len(vector_808) == 808:
-            return vector_808
+        with self._export_lock:
+            frames = self.snapshot(VECTOR_STREAMS)
+            missing = [stream for stream, frame in frames.items() if frame is None]
+            if missing:
+                print(f"WARNING: vector_808 is not 808 long (no data yet for: {', '.join(missing)})")
+                return
+
+            for stream, (seq, _, frame, _) in frames.items():
+                if seq != self._vector_seq[stream]:
+                    self._vector_sections[stream][...] = frame
+                    self._vector_seq[stream] = seq
+
+            if not copy:
+                view = self._vector.view()
+                view.flags.writeable = False
+                return view
+            if out is None:
+                return self._vector.copy()
+            np.copyto(out, self._vector)
+            return out
 
     def export_json(self):
         return json.dumps(self.export_np().tolist())
@@ -110,54 +393,73 @@ class NeurosityVectorizer:
         """
         For viewing convenience, this function exports brain data as a heatmap like image
         The data is normally in the shape (808,) but this function slices the data to an (800,) shape
-        then exports it as a 40x20 image in grayscale
+        then exports it as a 40x20 image in grayscale. See export_images for whole sessions.
         """
         # Get the data
         data = self.export_np()
-        # Slice the data to an (800,) shape
-        data = data[0:800]
-        # Minmax scale each segment of the data
-        data[0:128] = (data[0:128] - data[0:128].min()) / (data[0:128].max() - data[0:128].min())
-        data[128:256] = (data[128:256] - data[128:256].min()) / (data[128:256].max() - data[128:256].min())
-        data[256:768] = (data[256:768] - data[256:768].min()) / (data[256:768].max() - data[256:768].min())
-        data[768:800] = (data[768:800] - data[768:800].min()) / (data[768:800].max() - data[768:800].min())
-
-        # Reshape the data to a (40, 20) shape
-        data = data.reshape((40, 20))
-        # Return the data
-        return data
-
-    def signal_quality_callback(self, data):
-        fails = 0
-        for status in data:
-            # print(data)
-            print(status["status"], status["standardDeviation"])
-            if status["status"] not in ["good", "great"]:
-                fails += 1
-
-        if fails > self.max_fails:
-            print("Signal quality still not good enough (" + str(fails) + " fails)")
+        if data is None:
             return
-        self.quality_met = True
+        return export_images(data[np.newaxis])[0]
 
-    def ensure_quality(self, max_fails=3):
-        """Ensures a good signal quality for data collection and inference. Continually checks on the signal quality until it's good enough.
+    @staticmethod
+    def quality_score(data):
+        """
+        Scores a signal quality reading (one {"status", "standardDeviation"} per channel).
+
+        Returns:
+        tuple: (fraction of channels with "good" or "great" contact, number of other channels)
+        """
+        bad_channels = sum(1 for status in data if status["status"] not in ["good", "great"])
+        return 1. - bad_channels / len(data) if data else 0., bad_channels
+
+    def update_signal_quality(self, data):
+        # One attribute assignment, so readers always see a matching time and score
+        score, bad_channels = self.quality_score(data)
+        self.quality = (monotonic(), score, bad_channels)
+
+    def ensure_quality(self, max_fails=3, timeout=None):
+        """Ensures a good signal quality for data collection and inference. Waits for signal quality readings (without
+        polling) until one is good enough: at most max_bad_channels channels without "good" or "great" contact.
         Parameters:
-            max_fails (int): The maximum number of times the signal quality can fail before this function returns False. Default: 3"""
+            max_fails (int): The maximum number of times the signal quality can fail before this function returns False. Default: 3
+            timeout (float): Return False if no good reading arrived within this many seconds. Default: None (no limit)
 
-        signal_quality_unsub = self.simulator.signal_quality(self.signal_quality_callback)
-        while not self.quality_met:
-            sleep(1)
-        signal_quality_unsub()
-        return True
+        Returns:
+            bool: True once the quality is good, False after max_fails bad readings or the timeout."""
+        readings = queue.Queue()
+        signal_quality_unsub = self.simulator.signal_quality(readings.put)
+        deadline = monotonic() + timeout if timeout is not None else None
+        fails = 0
+        try:
+            while True:
+                remaining = deadline - monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    print("Signal quality not good enough (timed out)")
+                    return False
+                try:
+                    data = readings.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+                _, bad_channels = self.quality_score(data)
+                if bad_channels <= self.max_bad_channels:
+                    self.quality_met = True
+                    return True
+                fails += 1
+                print(f"Signal quality still not good enough ({bad_channels} channels with bad contact)")
+                if fails >= max_fails:
+                    return False
+        finally:
+            signal_quality_unsub()
 
-    def gather_samples(self, num_inputs, samples_per_input, sample_rate, data_label, data_class):
+    def gather_samples(self, num_inputs, samples_per_input, sample_rate, data_label, data_class, verbose=False,
+                       db_name="training_data.db", writer=None):
         """
         Gathers training data for a specified number of inputs, each with a specified number of samples.
         For example, if num_inputs is 2 and samples_per_input is 3, then 6 samples will be gathered.
         To expand on this example, if the sample rate is 250 (expressed as Hz), then 6 samples will be gathered with a 1/250 second interval between each sample,
         for a total of 1.5 seconds of data.
-        For each input taken, one .npy file will be produced in the appropriate training data folder.
+        For each input taken, one row (timestamp, label, class, data) is written to training_data_table.
+        The writes happen on a background thread (TrainingDataWriter), so saving never holds up sampling.
 
         Parameters:
         num_inputs (int): The number of inputs to gather data for.
@@ -165,9 +467,14 @@ class NeurosityVectorizer:
         sample_rate (int): The sample rate, expressed in Hz.
         data_label (str): The label for the data. For example, "doing_math"
         data_class (str): The class for the data. For example, "doing_math" vs "not_doing_math".
+        verbose (bool): Print a line for every sample and saved input. At high sample rates the printing alone
+            can't keep up, so it's off by default. Default: False
+        db_name (str): The SQLite database to write to. Default: "training_data.db"
+        writer (TrainingDataWriter): An open writer to reuse across calls. If None, one is opened for db_name
+            and closed (after committing everything) before returning. Default: None
 
         Returns:
-        None
+        None. The achieved sample rate and timing stats are in self.last_sampling_stats.
         """
         # sleep(1)
         # Calculate the length of time to gather data for and print it for the user
@@ -175,218 +482,404 @@ class NeurosityVectorizer:
         print(f"Sampling for {round(sampling_time_total, 5)} seconds...")
         actual_start_time = time()
 
-        # Make a training_data directory if it doesn't exist
-        if not path.exists("training_data"):
-           mkdir("training_data")
-        # Make a directory for the label if it doesn't exist
-        if not path.exists(f"training_data/{data_label}"):
-           mkdir(f"training_data/{data_label}")
-        # Make a directory for the class if it doesn't exist
-        if not path.exists(f"training_data/{data_label}/{data_class}"):
-           mkdir(f"training_data/{data_label}/{data_class}")
-
-        # Gather all the samples. They'll be split into inputs later.
-        all_samples = []
-        for i in range(num_inputs * samples_per_input):
-            start_time = time()
-
-            next_time = start_time + (1. / sample_rate)
-
-            all_samples.append(self.export_np()) # appends a vector (808,) to all_samples
-            # sleep(1. / sample_rate)
-            print(f"Sample {i + 1} of {num_inputs * samples_per_input} complete")
-
-
-            # New method - if there's now enough data in all_samples to make an input, save it
-            if len(all_samples) >= samples_per_input:
-                # Get the first samples_per_input samples
-                input_samples = all_samples[0:samples_per_input]
-                # Remove those samples from all_samples
-                all_samples = all_samples[samples_per_input:]
-                # Save the input
-                ts = int(round(time() * 1000))
+        own_writer = writer is None
+        if own_writer:
+            writer = TrainingDataWriter(db_name)
+
+        # Each input is filled in place, then handed to the writer as is. A new buffer is started for the next one.
+        # The scheduler keeps absolute deadlines, so the time spent below doesn't lower the sample rate.
+        input_samples = np.empty((samples_per_input, 808))
+        input_complete = True
+        skipped_inputs = 0
+        scheduler = SampleScheduler(rate=sample_rate)
+        for i in scheduler.ticks(num_inputs * samples_per_input):
+            # None until every stream has delivered a frame, the row is left unwritten then
+            if self.export_np(out=input_samples[i % samples_per_input]) is None:
+                input_complete = False
+            if verbose:
+                print(f"Sample {i + 1} of {num_inputs * samples_per_input} complete")
+
+            # If there's now enough data to make an input, save it
+            if (i + 1) % samples_per_input == 0:
+                if not input_complete:
+                    # Don't save an input with unwritten samples in it, reuse its buffer for the next one
+                    skipped_inputs += 1
+                    input_complete = True
+                    continue
                 t1 = time()
-                # np.save(f"training-data/{data_label}/{data_class}/{ts}.npy", input_samples)
-                # Old method was using np.save, but it's too slow. Run it in a thread instead.
-                # Thread(target=np.save, args=(f"training-data/{data_label}/{data_class}/{ts}.npy", input_samples)).start()
-                # newer method is to use a queue
-                # save_queue.put((f"training_data/{data_label}/{data_class}/{ts}.npy", input_samples)) # each input is a 2d array of shape (samples_per_input, 808)
-                # newest method is to use sqlite
-                # Will be accessed like: timestamp, data_label, data_class, data = sqlite_queue.get()
-
-            # naprinti si vse podatke k grejo v queue da vidis ker zajebe
-            #     print("ts", ts)
-            #     print("data_label", data_label)
-            #     print("data_class", data_class)
-                sqlite_queue.put((ts, data_label, data_class, input_samples))
-                t2 = time()
-                # print(f"Saved input {ts}.npy to training-data/{data_label}/{data_class}/ (took {round(t2-t1, 5)} seconds)")
-                print(f"Saved input {ts} to sqlite (took {round(t2 - t1, 5)} seconds)")
-
-            # Determine how long to sleep for
-            sleep_time = next_time - time()
-            # If sleep_time is positive, sleep until it's time to take the next sample
-            # print("DEBUG: sleep_time =", sleep_time)
-            if sleep_time > 0:
-                sleep(sleep_time)
+                # np.save, a thread per file, and a save queue were all too slow, so inputs go to sqlite in batches.
+                # The timestamp is stored in seconds, like convert_to_sqlite does for the legacy .npy files.
+                writer.put(t1, data_label, data_class, input_samples)
+                input_samples = np.empty((samples_per_input, 808))
+                if verbose:
+                    print(f"Saved input {round(t1 * 1000)} to sqlite (took {round(time() - t1, 5)} seconds)")
 
         # Print status
-        print(f"Saved {num_inputs * samples_per_input} samples to training_data/{data_label}/{data_class}/")
+        self.last_sampling_stats = scheduler.stats()
+        if own_writer:
+            writer.close()
+        else:
+            writer.flush()
+        saved_inputs = num_inputs - skipped_inputs
+        print(f"Saved {saved_inputs} inputs ({saved_inputs * samples_per_input} samples) for {data_label}/{data_class} "
+              f"to {writer.db_name}")
+        if skipped_inputs:
+            print(f"WARNING: {skipped_inputs} inputs not saved, not every stream had delivered data yet")
         print(f"total time taken: {round(time() - actual_start_time, 5)} seconds")
-        # Return nothing. Read from file instead.
+        print(f"achieved {round(self.last_sampling_stats['achieved_rate'], 2)} Hz (target {sample_rate} Hz), "
+              f"{self.last_sampling_stats['missed_ticks']} samples missed, "
+              f"jitter {round(self.last_sampling_stats['jitter'] * 1000, 3)} ms")
+        writer_stats = writer.stats()
+        if writer_stats["blocked_puts"]:
+            print(f"WARNING: the database fell behind {writer_stats['blocked_puts']} times "
+                  f"(sampling waited {round(writer_stats['blocked_time'], 5)} seconds)")
+        # Return nothing. Read from the database instead.
         return None
 
     def sample(self, num_samples, sample_rate):
         """Similar to gather_samples, but returns the samples instead of saving them to a file.
         Intended for use in real-time applications.
+        Samples taken before every stream had delivered a frame are NaN.
+        The timing stats of the run are in self.last_sampling_stats.
         """
         # Calculate the length of time to gather data for and print it for the user
         sampling_time_total = float(num_samples) / sample_rate
         # print(f"Sampling for {round(sampling_time_total,5)} seconds...")
 
-        # Gather all the samples. They'll be split into inputs later.
-        all_samples = []
-        for i in range(num_samples):
-            all_samples.append(self.export_np())
-            sleep(1. / sample_rate)
+        # Gather all the samples straight into one preallocated array. They'll be split into inputs later.
+        all_samples = np.empty((num_samples, 808))
+        scheduler = SampleScheduler(rate=sample_rate)
+        for i in scheduler.ticks(num_samples):
+            if self.export_np(out=all_samples[i]) is None:
+                all_samples[i] = np.nan  # not written by export_np
             # print(f"Sample {i + 1} of {num_samples} complete")
+        self.last_sampling_stats = scheduler.stats()
         # Return the samples
-        return np.array(all_samples)
+        return all_samples
 
-    def validate_samples(self, data_label):
+    def validate_samples(self, data_label, data_dir="training_data", workers=None, index_path=None):
         """
-        Validates the samples for all classes belonging to a specified label. It does this by loading each .npy file in the appropriate folder and checking its shape.
-        If the shape of any file is different from the others, this function will return False. Otherwise, it will return True.
+        Validates the samples for all classes belonging to a specified label by checking that every .npy file in the appropriate folder has the same shape.
+        Only the .npy headers are read (on a thread pool), never the data. The shapes are cached in
+        <data_dir>/<data_label>/.shape_index.json by (mtime, size), so repeat validations only re-read new or changed files.
+        If the index can't be written (e.g. a read-only archive) the samples are still validated, just not cached.
 
         Parameters:
         data_label (str): The label for the data. For example, "doing_math"
+        data_dir (str): The directory holding the label folders. Default: "training_data"
+        workers (int): Number of header reader threads. Default: None (ThreadPoolExecutor's default)
+        index_path (str): Where to cache the shapes instead, e.g. outside a data tree that isn't writable.
+            Default: None (<data_dir>/<data_label>/.shape_index.json)
 
         Returns:
         bool: True if the samples are valid, False otherwise.
         """
         # Get the directory for the label
-        directory = f"training_data/{data_label}/"
-        # Get the list of classes for the label
-        classes = [f for f in listdir(directory) if path.isdir(path.join(directory, f))]
-        # Get the shape of the first file
-        first_file = listdir(path.join("training_data/", data_label, classes[0]))[0]
-        shape = np.load(path.join(directory, classes[0], first_file)).shape
-        # Check the shape of each file
-        for c in classes:
-            for f in listdir(path.join(directory, c)):
-                if np.load(path.join(directory, c, f)).shape != shape:
-                    return False
+        directory = path.join(data_dir, data_label)
+        if index_path is None:
+            index_path = path.join(directory, ".shape_index.json")
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+
+        # Get the size and mtime of every file of every class, and the ones the index doesn't know (about) yet
+        files = {}
+        for data_class in sorted(entry.name for entry in os.scandir(directory) if entry.is_dir()):
+            for entry in os.scandir(path.join(directory, data_class)):
+                if entry.name.endswith(".npy"):
+                    stat = entry.stat()
+                    files[f"{data_class}/{entry.name}"] = (stat.st_mtime_ns, stat.st_size)
+        changed = [name for name, (mtime, size) in files.items()
+                   if name not in index or index[name][:2] != [mtime, size]]
+
+        # Files are handed to the threads in chunks, a task per file costs more than reading its header
+        chunk_size = max(1, min(256, len(changed) // 32))
+        chunks = [changed[i:i + chunk_size] for i in range(0, len(changed), chunk_size)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            shapes = executor.map(lambda chunk: [read_npy_shape(path.join(directory, name)) for name in chunk], chunks)
+            for chunk, chunk_shapes in zip(chunks, shapes):
+                for name, shape in zip(chunk, chunk_shapes):
+                    index[name] = [*files[name], shape]
+        # Forget deleted files
+        deleted = [name for name in index if name not in files]
+        for name in deleted:
+            del index[name]
+        if changed or deleted:
+            try:
+                with open(index_path, "w") as f:
+                    json.dump(index, f, separators=(",", ":"))
+            except OSError as e:
+                print(f"Could not save the shape index, validating without it: {e}")
+
+        # Check the shape of each file against the first one
+        shape = None
+        for name in sorted(index):
+            if index[name][2] is None:
+                print(f"{name} is not a valid .npy file")
+                return False
+            if shape is None:
+                shape = index[name][2]
+            elif index[name][2] != shape:
+                print(f"{name} has shape {tuple(index[name][2])}, expected {tuple(shape)}")
+                return False
         # If all the shapes are the same, return True
         return True
 
-    def convert_to_sqlite(self, db_name):
+    def convert_to_sqlite(self, db_name, data_dir="training_data", workers=None, batch_size=200):
+        """
+        Imports the legacy training_data/<label>/<class>/<timestamp in ms>.npy files into training_data_table.
+        Files are loaded on a thread pool while the previous batch is inserted (executemany, one transaction per
+        batch). Inputs that are already in the database are skipped without being loaded, so the conversion can be
+        interrupted and re-run. Duplicates are also rejected by the UNIQUE (timestamp, label, class) index.
+
+        Parameters:
+        db_name (str): The SQLite database to write to.
+        data_dir (str): The directory holding the label folders. Default: "training_data"
+        workers (int): Number of loader threads. Default: None (ThreadPoolExecutor's default)
+        batch_size (int): Files per transaction. Two batches are in memory at a time (the one being inserted and the
+            next one loading), about 65 MB for the default with 25-sample inputs. Default: 200
+
+        Returns:
+        int: The number of inputs inserted.
+        """
         # Make sure that the DB exists and has the proper tables
         conn = sqlite3.connect(db_name)
-        c = conn.cursor()
-        c.execute(
-            "CREATE TABLE IF NOT EXISTS training_data_table (id INTEGER PRIMARY KEY, timestamp REAL, label TEXT, class TEXT, data BLOB)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_training_data ON training_data_table (timestamp, label, class)")
-
-        # Get a list of all the directories in training-data
-        labels = [f for f in listdir("training_data/") if path.isdir(path.join("training_data/", f))]
-        # Iterate over each label
-        for label in labels:
-            # Get all the classes for the label
-            classes = [f for f in listdir(path.join("training_data/", label)) if
-                       path.isdir(path.join("training_data/", label, f))]
-            # Iterate over each class
-            for data_class in classes:
-                counter = 0
-                print("Converting", label + "/" + data_class)
-                # Get all the files for the class
-                files = [f for f in listdir(path.join("training_data/", label, data_class)) if f.endswith(".npy")]
-                # Iterate over each file
-                for f in files:
-                    try:
-                        # Load the file
-                        data = np.load(path.join("training_data/", label, data_class, f))
-                        # Flatten to a 1d array, since that's my new standard rather than time series
-                        data = data.flatten()
-                        # Convert the data to a buffer
-                        data = data.tobytes()
-                        # See if a row already exists with  this timestamp, label, and class
-                        c.execute("SELECT * FROM training_data WHERE timestamp=? AND label=? AND class=?",
-                                  (float(f.replace(".npy", "")) / 1000., label, data_class))
-                        # If so, don't insert it again
-                        if c.fetchone() is not None:
-                            continue
-                        # Insert the data into the DB
-                        c.execute("INSERT INTO training_data (timestamp, label, class, data) VALUES (?, ?, ?, ?)",
-                                  (float(f.replace(".npy", "")) / 1000., label, data_class, data))
-                        # Increment the counter and print a status every 1k files
-                        counter += 1
-                        if counter % 1000 == 0:
-                            print("Processed", counter, "files in training_data/" + label + "/" + data_class)
-                            # Commit the changes
-                            conn.commit()
-                    except Exception as e:
-                        print("Error loading file", f, e)
-        # Commit the changes and close the connection
+        conn.execute("PRAGMA journal_mode=WAL")
+        create_training_data_table(conn)
         conn.commit()
+
+        # Find every file that isn't in the DB yet. One query per class instead of one per file.
+        files = []
+        skipped = 0
+        for label in sorted(entry.name for entry in os.scandir(data_dir) if entry.is_dir()):
+            for data_class in sorted(entry.name for entry in os.scandir(path.join(data_dir, label)) if entry.is_dir()):
+                existing = {row[0] for row in conn.execute(
+                    "SELECT timestamp FROM training_data_table WHERE label = ? AND class = ?", (label, data_class))}
+                for entry in os.scandir(path.join(data_dir, label, data_class)):
+                    if not entry.name.endswith(".npy"):
+                        continue
+                    try:
+                        timestamp = float(entry.name[:-len(".npy")]) / 1000.
+                    except ValueError:
+                        print("Error loading file", entry.path, "(the file name is not a timestamp)")
+                        continue
+                    if timestamp in existing:
+                        skipped += 1
+                        continue
+                    files.append((entry.path, timestamp, label, data_class))
+        print(f"Converting {len(files)} files ({skipped} already in {db_name})")
+
+        def load(file):
+            file_path, timestamp, label, data_class = file
+            try:
+                # Flatten to a 1d array, since that's my new standard rather than time series
+                return timestamp, label, data_class, np.load(file_path).flatten().tobytes()
+            except Exception as e:
+                print("Error loading file", file_path, e)
+
+        inserted = 0
+        processed = 0
+        start_time = time()
+        insert = "INSERT OR IGNORE INTO training_data_table (timestamp, label, class, data) VALUES (?, ?, ?, ?)"
+        batches = [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Always keep the next batch loading while the current one is inserted
+            pending = [executor.submit(load, file) for file in batches[0]] if batches else []
+            for i in range(len(batches)):
+                current = pending
+                pending = [executor.submit(load, file) for file in batches[i + 1]] if i + 1 < len(batches) else []
+                rows = [row for row in (future.result() for future in current) if row is not None]
+                before = conn.total_changes
+                conn.executemany(insert, rows)
+                conn.commit()
+                inserted += conn.total_changes - before
+                processed += len(current)
+
+                elapsed = time() - start_time
+                rate = processed / elapsed if elapsed else 0.
+                remaining = (len(files) - processed) / rate if rate else 0.
+                print(f"Processed {processed}/{len(files)} files ({rate:.0f} files/s, {remaining:.0f} s left)")
+
         # Close the connection
         conn.close()
-        print("Done converting to sqlite")
+        print(f"Done converting to sqlite ({inserted} inputs inserted)")
+        return inserted
 
     def gather_eeg_samples_during_song(self):
-        # append current song data to the current song data arrays
-
-        # convert psd to numpy array
-        psd = np.array(self.latest_psd)
-        psd = psd[:, 0:26]
-        self.current_song_psd = np.concatenate((self.current_song_psd, psd[np.newaxis, ...]), axis=0)
-
-        bands = np.array(self.latest_power_by_band)
-        self.current_song_power_by_band = np.concatenate((self.current_song_power_by_band, bands[np.newaxis, ...]), axis=0)
-
-        if self.latest_focus is not None:
-            self.current_song_focus = np.append(self.current_song_focus, self.latest_focus)
-
-        if self.latest_calm is not None:
-            self.current_song_calm = np.append(self.current_song_calm, self.latest_calm)
+        """
+        Adds every PSD, power by band, focus and calm frame that arrived since the last call to the current song's data.
+        Each frame is added exactly once, however often (or rarely, up to channel_size frames) this is called.
+        Not needed in event-driven mode, where the collector thread does this as the frames arrive.
 
+        Returns:
+        bool: True if a new PSD frame was added.
+        """
+        with self._song_lock:
+            # PSD last: a PSD frame that arrives while the others are drained is left for the next call, so the
+            # frames it gets paired with (see _pair_samples) have all been drained already
+            for stream in ("power_by_band", "focus", "calm", "psd"):
+                frames = self.channels[stream].drain()
+                self._add_frames(stream, frames)
+                if self.record_samples:
+                    self._unpaired[stream].extend(frames)
+            if self.record_samples:
+                self._pair_samples()
+            return len(frames) > 0
+
+    def _add_frames(self, stream, frames):
+        # append frames of one stream to the current song data accumulators. Called with _song_lock held.
+        for _, _, frame, quality in frames:
+            if self.min_quality is not None and quality is not None and quality < self.min_quality:
+                # bad contact: leave the frame out of the song's statistics
+                if stream == "psd":
+                    self.excluded_frames += 1
+                continue
+            if stream == "psd":
+                self.current_song_psd.append(frame[:, 0:26])
+            elif stream == "power_by_band":
+                self.current_song_power_by_band.append(frame)
+            elif stream == "focus":
+                self.current_song_focus.append(frame)
+            elif stream == "calm":
+                self.current_song_calm.append(frame)
+
+    def _pair_samples(self, final=False):
+        # One record per PSD frame, with the power by band, focus and calm frames that arrived nearest to it (the
+        # streams come from separate threads, at the same rate). Called with _song_lock held. A PSD frame whose
+        # nearest frame may still be on its way waits, unless final or older than pair_timeout.
+        psd_frames = self._unpaired["psd"]
+        now = monotonic()
+        while psd_frames:
+            _, arrived, psd, quality = psd_frames[0]
+            wait = not final and now - arrived < self.pair_timeout
+            companions = {}
+            for stream in ("power_by_band", "focus", "calm"):
+                frames = self._unpaired[stream]
+                # Frames before the nearest one are no use for this or any later PSD frame
+                while len(frames) > 1 and abs(frames[1][1] - arrived) <= abs(frames[0][1] - arrived):
+                    frames.popleft()
+                if frames and (frames[0][1] >= arrived or len(frames) > 1 or not wait):
+                    companions[stream] = frames[0][2]
+                elif wait:
+                    return
+                else:
+                    companions[stream] = None
+            psd_frames.popleft()
+            if companions["power_by_band"] is None:
+                # no power by band frame received from the device yet
+                continue
+            self._record_sample(arrived, psd[:, 0:26], companions, quality)
+
+        # Without PSD frames the other streams only need their newest frames
+        for stream in ("power_by_band", "focus", "calm"):
+            frames = self._unpaired[stream]
+            while len(frames) > 2:
+                frames.popleft()
+
+    def _record_sample(self, arrived, psd, companions, quality):
+        # recorded even with bad contact, tagged with the quality score
+        if self.current_song_start is None:
+            self.current_song_start = arrived
+        blob = np.concatenate((psd.ravel(), companions["power_by_band"].ravel())).astype(np.float32).tobytes()
+        self.pending_samples.append((arrived - self.current_song_start, blob, companions["focus"], companions["calm"],
+                                     quality))
+
+    def drain_samples(self, final=False):
+        """
+        Returns the per-sample records gathered since the last call and forgets them.
+        Each record is (seconds since song start, float32 PSD+bands blob, focus, calm, quality score or None),
+        ready for SpotifyAPI.add_eeg_samples.
 
+        Parameters:
+        final (bool): Also pair the PSD frames still waiting for their power by band/focus/calm frames with the
+            ones there are, e.g. at the end of a song. Default: False
+        """
+        with self._song_lock:
+            if final:
+                self._pair_samples(final=True)
+            samples, self.pending_samples = self.pending_samples, []
+        return samples
 
+    def get_current_song_eeg_data(self):
+        with self._song_lock:
+            eeg_dict = self._current_song_eeg_data()
+        print("Current song EEG data gathered")
+        return eeg_dict
 
+    def finish_song(self):
+        """
+        Ends the current song: pairs the PSD frames still waiting (like drain_samples(final=True)), computes the
+        song's EEG data and resets it, all under one lock. A frame gathered meanwhile (by the collector thread in
+        event-driven mode) goes to the next song, instead of being reset between the steps and counted for neither.
 
-    def get_current_song_eeg_data(self):
-        self.current_song_psd = np.mean(self.current_song_psd, axis=0)
-        self.current_song_power_by_band = np.mean(self.current_song_power_by_band, axis=0)
+        Returns:
+        tuple: (eeg_dict, samples), the song's EEG data (see get_current_song_eeg_data) and its per-sample records
+            not drained yet (see drain_samples).
+        """
+        with self._song_lock:
+            self._pair_samples(final=True)
+            samples, self.pending_samples = self.pending_samples, []
+            eeg_dict = self._current_song_eeg_data()
+            self._reset_current_song_eeg_data()
+        print("Current song EEG data gathered and reset")
+        return eeg_dict, samples
+
+    def _current_song_eeg_data(self):
+        # means are computed over the filled views of the accumulators, without copying them
+        psd = self.current_song_psd.mean()
+        power_by_band = self.current_song_power_by_band.mean()
         # split the power by band into individual bands
-        self.current_song_alpha = self.current_song_power_by_band[0,:]
-        self.current_song_beta = self.current_song_power_by_band[1,:]
-        self.current_song_delta = self.current_song_power_by_band[2,:]
-        self.current_song_gamma = self.current_song_power_by_band[3,:]
-        self.current_song_theta = self.current_song_power_by_band[4,:]
+        self.current_song_alpha = power_by_band[0,:]
+        self.current_song_beta = power_by_band[1,:]
+        self.current_song_delta = power_by_band[2,:]
+        self.current_song_gamma = power_by_band[3,:]
+        self.current_song_theta = power_by_band[4,:]
 
-        self.current_song_focus = np.mean(self.current_song_focus)
-        self.current_song_calm = np.mean(self.current_song_calm)
+        focus = self.current_song_focus.mean()
+        calm = self.current_song_calm.mean()
 
-        print("Current song EEG data gathered")
+        power_by_band_var = self.current_song_power_by_band.var()
 
         # put in a dict and return
 
         eeg_dict = {
-            "psd": self.current_song_psd,
+            "psd": psd,
             "alpha": self.current_song_alpha,
             "beta": self.current_song_beta,
             "delta": self.current_song_delta,
             "gamma": self.current_song_gamma,
             "theta": self.current_song_theta,
-            "focus": self.current_song_focus,
-            "calm": self.current_song_calm
+            "focus": focus,
+            "calm": calm,
+            # dispersion of the samples the means above were computed from
+            "psd_var": self.current_song_psd.var(),
+            "alpha_var": power_by_band_var[0,:],
+            "beta_var": power_by_band_var[1,:],
+            "delta_var": power_by_band_var[2,:],
+            "gamma_var": power_by_band_var[3,:],
+            "theta_var": power_by_band_var[4,:],
+            "focus_var": self.current_song_focus.var(),
+            "calm_var": self.current_song_calm.var(),
+            "sample_count": len(self.current_song_psd)
         }
         return eeg_dict
         # return self.current_song_psd, self.current_song_alpha,self.current_song_beta, self.current_song_delta, self.current_song_gamma,self.current_song_theta, self.current_song_focus, self.current_song_calm
 
     def reset_current_song_eeg_data(self):
-        self.current_song_psd = np.zeros((0,8,26))
-        self.current_song_power_by_band = np.zeros((0,5,8))
-        self.current_song_focus = np.array([])
-        self.current_song_calm = np.array([])
+        with self._song_lock:
+            self._reset_current_song_eeg_data()
 
         print("Current song EEG data reset")
+
+    def _reset_current_song_eeg_data(self):
+        # Called with _song_lock held
+        self.current_song_psd.reset()
+        self.current_song_power_by_band.reset()
+        self.current_song_focus.reset()
+        self.current_song_calm.reset()
+        self.current_song_start = None
+        self.pending_samples = []  # drain_samples() first to keep them
+        self._unpaired["psd"].clear()
+        self.excluded_frames = 0
@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event, Lock
+
+
+class PlaybackMonitor:
+    """
+    Polls Spotify for the currently playing track on a background thread, so a slow API response never
+    stalls EEG sampling. The poll only reads current_playback. When the track changes, the full song metrics
+    (audio features) are resolved once, on a separate worker thread, and optionally written to the database.
+
+    Parameters:
+        spotify_api (SpotifyAPI): Instance of the SpotifyAPI class.
+        poll_interval (float): Seconds between "track changed?" polls. Default: 0.25
+        db_name (str): If given, each newly seen song is added to this database once its metrics are resolved.
+        on_track_change (callable): Optional callback(track) run on the polling thread when the track changes.
+            track is None when playback stops.
+    """
+    def __init__(self, spotify_api, poll_interval=0.25, db_name=None, on_track_change=None):
+        self.spotify_api = spotify_api
+        self.poll_interval = poll_interval
+        self.db_name = db_name
+        self.on_track_change = on_track_change
+
+        self.current_track = None  # replaced atomically by the polling thread, safe to read from any thread
+        self._metrics_futures = {}
+        self._futures_lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="SongMetrics")
+        self._stop = Event()
+        self._thread = None
+
+    def start(self):
+        """Does one synchronous poll, so current_track is set when this returns, then starts polling in the background."""
+        self._poll()
+        self._thread = Thread(target=self._run, name="PlaybackMonitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            self._poll()
+
+    def _poll(self):
+        try:
+            track = self.spotify_api.get_current_track()
+        except Exception as e:
+            # Network hiccups shouldn't kill the monitor, just try again on the next poll
+            print(f"An error occurred while polling the current playback: {e}")
+            return
+
+        previous = self.current_track
+        changed = (track and track["id"]) != (previous and previous["id"])
+        if changed and track is not None:
+            self._resolve_metrics(track)
+        self.current_track = track  # replaced on every poll, so pause/resume of the same track is visible
+        if changed and self.on_track_change is not None:
+            self.on_track_change(track)
+
+    def _resolve_metrics(self, track):
+        with self._futures_lock:
+            if track["id"] not in self._metrics_futures:
+                self._metrics_futures[track["id"]] = self._executor.submit(self._fetch_metrics, track)
+
+    def _fetch_metrics(self, track):
+        song_metrics = self.spotify_api.get_song_metrics(track)
+        if song_metrics is not None and self.db_name is not None:
+            self.spotify_api.add_song_to_database(song_metrics, self.db_name)
+        return song_metrics
+
+    def get_song_metrics(self, track_id, timeout=None):
+        """
+        Returns the resolved song metrics for a track seen by the monitor, waiting for the worker if needed.
+        Once this returns, the song has been queued for the database, so EEG data referencing it can follow.
+
+        Returns:
+            dict: The song metrics, or None if the track was never seen or has no audio features.
+        """
+        with self._futures_lock:
+            future = self._metrics_futures.pop(track_id, None)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout)
+        except Exception as e:
+            print(f"An error occurred while resolving the song metrics: {e}")
+            return None
@@ -0,0 +1,118 @@
+from time import monotonic, sleep
+
+from accumulator_class import RunningStats
+
+
+class SampleScheduler:
+    """
+    Calls a sampling loop at a fixed rate without drifting. Every tick has an absolute deadline
+    (start + n * interval), so the time spent taking a sample, and the oversleep of the OS, never push the
+    following samples back. Sleeps until shortly before each deadline and, optionally, busy-waits the rest,
+    which gets the jitter at high rates (e.g. 250 Hz) well below the scheduler granularity of sleep().
+
+    Usage:
+        scheduler = SampleScheduler(rate=250)
+        for i in scheduler.ticks(1000):
+            take_sample()
+        print(scheduler.stats())
+
+    Parameters:
+        rate (float): Ticks per second. Either rate or interval must be given.
+        interval (float): Seconds between ticks.
+        spin (float): Busy-wait for the last spin seconds before each deadline. 0 just sleeps. Default: 0.001
+        stop_event (threading.Event): If given, waiting ends as soon as it's set and ticks() stops. Default: None
+        catch_up (bool): What to do when a sample overran by more than a whole interval. If True the missed ticks
+            are run back to back, so the number of samples matches the elapsed time. If False they're skipped
+            (and counted in missed_ticks), so the spacing stays regular. Default: False
+    """
+    def __init__(self, rate=None, interval=None, spin=0.001, stop_event=None, catch_up=False):
+        if (rate is None) == (interval is None):
+            raise ValueError("Give either rate or interval")
+        self.interval = interval if interval is not None else 1. / rate
+        if self.interval <= 0:
+            raise ValueError("The rate/interval must be positive")
+        self.spin = spin
+        self.stop_event = stop_event
+        self.catch_up = catch_up
+        self.reset()
+
+    def reset(self):
+        """Restarts the schedule (the next tick is due straight away) and clears the stats."""
+        self.next_deadline = None
+        self.first_tick_time = None
+        self.last_tick_time = None
+        self.tick_count = 0
+        self.overruns = 0
+        self.missed_ticks = 0
+        self.lateness = RunningStats()
+
+    def wait(self):
+        """
+        Waits for the next tick. The first call returns straight away and starts the schedule.
+
+        Returns:
+        bool: False if stop_event was set (stop sampling), True otherwise.
+        """
+        now = monotonic()
+        if self.next_deadline is None:
+            self.next_deadline = now
+        else:
+            self.next_deadline += self.interval
+            if now > self.next_deadline + self.interval:
+                # The last sample took longer than a whole interval
+                self.overruns += 1
+                if not self.catch_up:
+                    missed = int((now - self.next_deadline) / self.interval)
+                    self.missed_ticks += missed
+                    self.next_deadline += missed * self.interval
+
+        if not self._sleep_until(self.next_deadline):
+            return False
+        self.last_tick_time = monotonic()
+        if self.first_tick_time is None:
+            self.first_tick_time = self.last_tick_time
+        self.lateness.append(self.last_tick_time - self.next_deadline)
+        self.tick_count += 1
+        return True
+
+    def ticks(self, count=None):
+        """Yields the tick number (0, 1, ...) at each tick, count times or until stop_event is set."""
+        i = 0
+        while count is None or i < count:
+            if not self.wait():
+                return
+            yield i
+            i += 1
+
+    def _sleep_until(self, deadline):
+        remaining = deadline - monotonic() - self.spin
+        if remaining > 0:
+            if self.stop_event is not None:
+                if self.stop_event.wait(remaining):
+                    return False
+            else:
+                sleep(remaining)
+        while monotonic() < deadline:
+            if self.stop_event is not None and self.stop_event.is_set():
+                return False
+        return self.stop_event is None or not self.stop_event.is_set()
+
+    def stats(self):
+        """
+        Returns:
+        dict: target_rate and achieved_rate (Hz), ticks, overruns (ticks that came due more than an interval late),
+            missed_ticks (skipped because of overruns), and the mean/max/std lateness of the ticks in seconds.
+        """
+        elapsed = (self.last_tick_time - self.first_tick_time) if self.tick_count > 1 else 0.
+        lateness = self.lateness
+        return {
+            "target_rate": 1. / self.interval,
+            # intervals between the first and the last tick, over the time they took
+            "achieved_rate": (self.tick_count - 1) / elapsed if elapsed else 0.,
+            "ticks": self.tick_count,
+            "overruns": self.overruns,
+            "missed_ticks": self.missed_ticks,
+            "mean_lateness": float(lateness.mean()) if len(lateness) else 0.,
+            "max_lateness": float(lateness.max()) if len(lateness) else 0.,
+            "jitter": float(lateness.var()) ** 0.5 if len(lateness) else 0.,
+        }
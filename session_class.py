@@ -0,0 +1,258 @@
+import asyncio
+import contextlib
+from collections import deque
+
+
+class AsyncStream:
+    """
+    Turns a Neurosity SDK subscription (subscribe(callback) -> unsubscribe) into an async iterator.
+    The SDK calls back on its own thread, frames are handed to the event loop with call_soon_threadsafe.
+    If the consumer falls behind, the oldest frames are dropped and counted in self.dropped.
+
+    Usage:
+        async with AsyncStream(neurosity.brainwaves_psd) as psd_stream:
+            async for frame in psd_stream:
+                ...
+    """
+    def __init__(self, subscribe, maxsize=256):
+        self.subscribe = subscribe
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._frames = deque()
+        self._frame_ready = None
+        self._loop = None
+        self._unsubscribe = None
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        self._frame_ready = asyncio.Event()
+        self._unsubscribe = self.subscribe(self._callback)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+
+    def _callback(self, data):
+        # Runs on the SDK thread
+        self._loop.call_soon_threadsafe(self._push, data)
+
+    def _push(self, data):
+        if len(self._frames) >= self.maxsize:
+            self._frames.popleft()
+            self.dropped += 1
+        self._frames.append(data)
+        self._frame_ready.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._frames:
+            self._frame_ready.clear()
+            await self._frame_ready.wait()
+        return self._frames.popleft()
+
+
+class SessionEngine:
+    """
+    asyncio engine for one listening session: one Neurosity device and one Spotify account.
+    The PSD, power by band, focus and calm streams are AsyncStreams, so their frames reach the vectorizer on the
+    event loop, and EEG is gathered on every PSD frame (instead of on a fixed 250 ms tick). The vectorizer has to be
+    created with subscribe_gathered=False for that. An event-driven vectorizer (NeurosityVectorizer(...,
+    event_driven=True)) can be used instead, its collector thread does the gathering. Spotify
+    is polled in the default executor so a slow response never blocks the event loop. A track change
+    is handled as soon as the poll that sees it returns.
+    Several engines (devices/users) can run in one process, see run_sessions.
+
+    Parameters:
+        spotify_api (SpotifyAPI): Instance of the SpotifyAPI class.
+        neurosity_vectorizer (NeurosityVectorizer): Instance of the NeurosityVectorizer class.
+        db_name (str): Name of the SQLite database.
+        poll_interval (float): Seconds between Spotify playback polls. Default: 0.25
+        sample_batch_size (int): If the vectorizer records per-sample data, it is written in batches of this size. Default: 64
+    """
+    def __init__(self, spotify_api, neurosity_vectorizer, db_name="music_focus.db", poll_interval=0.25,
+                 sample_batch_size=64):
+        self.spotify_api = spotify_api
+        self.neurosity_vectorizer = neurosity_vectorizer
+        self.db_name = db_name
+        self.poll_interval = poll_interval
+        self.sample_batch_size = sample_batch_size
+
+        self.current_track = None
+        self.recorded_song_ids = []
+        self._song_metrics_task = None
+        self._stop_event = None
+        self._max_songs = None
+
+    async def run_session(self, stop_event=None, max_songs=None):
+        """
+        Records every song played until stop_event is set or max_songs songs have been saved.
+        The song playing when the session stops is finished and saved like a skipped song.
+
+        Args:
+            stop_event (asyncio.Event): Set it to end the session. Default: None (run until max_songs or cancelled)
+            max_songs (int): Stop after this many songs have been finished. Default: None (no limit)
+
+        Returns:
+            list: IDs of the songs whose EEG data was saved.
+        """
+        stop_event = stop_event or asyncio.Event()
+        self._max_songs = max_songs
+        self._stop_event = stop_event
+
+        vectorizer = self.neurosity_vectorizer
+        if vectorizer.subscribe_gathered and not vectorizer.event_driven:
+            raise ValueError("SessionEngine needs a NeurosityVectorizer created with subscribe_gathered=False "
+                             "(or event_driven=True)")
+
+        # Status transitions are pushed on the SDK's thread, they're handled on the event loop
+        loop = asyncio.get_running_loop()
+        status_listener = lambda old, new: loop.call_soon_threadsafe(self._on_status_change)
+        vectorizer.status_listeners.append(status_listener)
+
+        tasks = [asyncio.create_task(self._poll_playback())]
+        if not vectorizer.subscribe_gathered:
+            tasks.append(asyncio.create_task(self._sample_eeg()))
+        try:
+            await stop_event.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Gathers the frames that arrived since the last PSD frame
+            vectorizer.stop_recording()
+            if self.current_track is not None:
+                await self._finish_song()
+            vectorizer.status_listeners.remove(status_listener)
+            self.spotify_api.flush(self.db_name)
+        return self.recorded_song_ids
+
+    async def _sample_eeg(self):
+        vectorizer = self.neurosity_vectorizer
+        device = vectorizer.simulator
+        streams = {
+            "psd": (device.brainwaves_psd, vectorizer.update_psd),
+            "power_by_band": (device.brainwaves_power_by_band, vectorizer.update_power_by_band),
+            "focus": (device.focus, vectorizer.update_focus),
+            "calm": (device.calm, vectorizer.update_calm),
+        }
+        async with contextlib.AsyncExitStack() as stack:
+            consumers = []
+            for stream, (subscribe, update) in streams.items():
+                frames = await stack.enter_async_context(AsyncStream(subscribe))
+                consumers.append(self._consume_stream(stream, frames, update))
+            # Cancelling this task cancels the consumers, then the streams are unsubscribed
+            await asyncio.gather(*consumers)
+
+    async def _consume_stream(self, stream, frames, update):
+        vectorizer = self.neurosity_vectorizer
+        async for data in frames:
+            # On the event loop, so the vectorizer's channels get their frames from this thread only
+            update(data)
+            # Gathered on every PSD frame, while recording (see _poll_playback)
+            track = self.current_track
+            if stream == "psd" and vectorizer.recording and track is not None:
+                vectorizer.gather_eeg_samples_during_song()
+                if len(vectorizer.pending_samples) >= self.sample_batch_size:
+                    self._save_samples(track["id"])
+
+    async def _poll_playback(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                track = await loop.run_in_executor(None, self.spotify_api.get_current_track)
+            except Exception as e:
+                print(f"An error occurred while polling the current playback: {e}")
+                track = self.current_track
+
+            if (track and track["id"]) != (self.current_track and self.current_track["id"]):
+                await self._on_track_change(track)
+            elif track is not None:
+                self.current_track = track  # same song, but is_playing may have changed
+
+            # Frames are only gathered while something is playing (event-driven: by the vectorizer's collector thread)
+            vectorizer = self.neurosity_vectorizer
+            if self.current_track is not None and self.current_track["is_playing"] and self._device_ready():
+                vectorizer.start_recording()
+                if vectorizer.event_driven and len(vectorizer.pending_samples) >= self.sample_batch_size:
+                    self._save_samples(self.current_track["id"])
+            else:
+                vectorizer.stop_recording()
+
+            await asyncio.sleep(self.poll_interval)
+
+    async def _on_track_change(self, track):
+        if self.current_track is not None:
+            await self._finish_song()
+
+        self.current_track = track
+        if track is None:
+            print("Playback stopped, waiting for the next song")
+            return
+
+        print(f"Now playing: {track['track_name']} by {', '.join(track['artists'])}")
+        # Resolve the audio features in the background while the song plays
+        loop = asyncio.get_running_loop()
+        self._song_metrics_task = loop.run_in_executor(None, self.spotify_api.get_song_metrics, track)
+
+    def _on_status_change(self):
+        # Pause collecting as soon as the device goes offline or starts charging, resume when it's back
+        track = self.current_track
+        if not self._device_ready():
+            self.neurosity_vectorizer.stop_recording()
+        elif track is not None and track["is_playing"]:
+            self.neurosity_vectorizer.start_recording()
+
+    def _device_ready(self):
+        # The status is pushed by the device (see NeurosityVectorizer.update_status), so it is current
+        vectorizer = self.neurosity_vectorizer
+        return vectorizer.status == "online" and not vectorizer.charging
+
+    def _save_samples(self, song_id, samples=None):
+        vectorizer = self.neurosity_vectorizer
+        if samples is None:
+            samples = vectorizer.drain_samples()
+        if samples:
+            self.spotify_api.add_eeg_samples(song_id, samples, self.db_name, min_quality=vectorizer.min_quality)
+
+    async def _finish_song(self):
+        vectorizer = self.neurosity_vectorizer
+        song_id = self.current_track["id"]
+        eeg_dict, samples = vectorizer.finish_song()
+        self._save_samples(song_id, samples)
+        self.current_track = None
+
+        song_metrics = None
+        if self._song_metrics_task is not None:
+            try:
+                song_metrics = await self._song_metrics_task
+            except Exception as e:
+                print(f"An error occurred while resolving the song metrics: {e}")
+            self._song_metrics_task = None
+
+        # Collection was paused while the device couldn't save, so the song is saved if any EEG was collected,
+        # whatever the status is now
+        if song_metrics is None:
+            print("EEG data not added - Song metrics could not be resolved")
+        elif eeg_dict["sample_count"] == 0:
+            print("EEG data not added - No EEG collected (device offline, charging or with bad contact)")
+        else:
+            # The song row has to be queued before the EEG row that references it
+            self.spotify_api.add_song_to_database(song_metrics, self.db_name)
+            self.spotify_api.add_eeg_metrics(song_id, eeg_dict, self.db_name)
+            self.recorded_song_ids.append(song_id)
+
+        if self._max_songs is not None and len(self.recorded_song_ids) >= self._max_songs:
+            self._stop_event.set()
+
+
+async def run_sessions(engines, stop_event=None):
+    """Runs several SessionEngines (e.g. one per device/user) concurrently until stop_event is set."""
+    stop_event = stop_event or asyncio.Event()
+    return await asyncio.gather(*(engine.run_session(stop_event) for engine in engines))
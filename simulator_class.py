@@ -0,0 +1,280 @@
+import zlib
+from threading import Thread, Event, Lock
+from time import monotonic, sleep
+
+import numpy as np
+
+
+# Native rates (frames per second) of the Neurosity streams
+NATIVE_RATES = {
+    "raw": 250 / 16,  # 16 samples per frame at 250 Hz
+    "raw_unfiltered": 250 / 16,
+    "psd": 4,
+    "power_by_band": 4,
+    "focus": 4,
+    "calm": 4,
+    "signal_quality": 1,
+    "status": 1,
+}
+BANDS = ["alpha", "beta", "delta", "gamma", "theta"]
+
+
+class ReplayDevice:
+    """
+    Stand-in for the NeurositySDK that replays recorded (or synthetic) frames, so the collection pipeline can be
+    run and load-tested without a device or network. Implements the subscription methods NeurosityVectorizer
+    uses (brainwaves_raw, brainwaves_psd, ..., signal_quality, status) plus status_once.
+
+    Parameters:
+        recording (str): Path of an .npz file written by record_device. Default: None (deterministic synthetic data)
+        speed (float): Replay speed relative to the native rates, e.g. 10 for ten times faster than real time.
+            0 means as fast as possible. Default: 1.0
+        autoplay (bool): If True every subscription gets its own thread emitting frames at the (scaled) native rate.
+            If False nothing is emitted until step() is called, for fully deterministic tests. Default: True
+        rates (dict): Per-stream overrides of NATIVE_RATES.
+        status (dict): What status_once returns. Default: online, not charging
+        seed (int): Seed for the synthetic data. Default: 0
+        num_frames (int): Number of synthetic frames per stream (replay loops around). Default: 256
+    """
+    def __init__(self, recording=None, speed=1.0, autoplay=True, rates=None, status=None, seed=0, num_frames=256):
+        self.speed = speed
+        self.autoplay = autoplay
+        self.rates = dict(NATIVE_RATES, **(rates or {}))
+        self.device_status = status or {"state": "online", "charging": False}
+        self.frames = load_recording(recording) if recording else synthetic_frames(num_frames, seed)
+
+        self.frames_sent = {}
+        self._subscribers = {}  # stream -> list of callbacks
+        self._positions = {}
+        self._lock = Lock()
+        self._threads = []
+        self._stop = Event()
+
+    # NeurositySDK interface
+    def brainwaves_raw(self, callback):
+        return self._subscribe("raw", callback)
+
+    def brainwaves_raw_unfiltered(self, callback):
+        return self._subscribe("raw_unfiltered", callback)
+
+    def brainwaves_psd(self, callback):
+        return self._subscribe("psd", callback)
+
+    def brainwaves_power_by_band(self, callback):
+        return self._subscribe("power_by_band", callback)
+
+    def focus(self, callback):
+        return self._subscribe("focus", callback)
+
+    def calm(self, callback):
+        return self._subscribe("calm", callback)
+
+    def signal_quality(self, callback):
+        return self._subscribe("signal_quality", callback)
+
+    def status(self, callback):
+        return self._subscribe("status", callback)
+
+    def status_once(self):
+        return dict(self.device_status)
+
+    # Replay control
+    def step(self, count=1):
+        """Emits the next count frames of every subscribed stream, synchronously on the calling thread."""
+        for _ in range(count):
+            for stream in list(self._subscribers):
+                self._emit(stream)
+
+    def stop(self):
+        """Stops all replay threads."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _subscribe(self, stream, callback):
+        with self._lock:
+            first = stream not in self._subscribers
+            self._subscribers.setdefault(stream, []).append(callback)
+        if first and self.autoplay:
+            thread = Thread(target=self._run, args=(stream,), name=f"ReplayDevice({stream})", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers.get(stream, []):
+                    self._subscribers[stream].remove(callback)
+        return unsubscribe
+
+    def _run(self, stream):
+        interval = 1. / (self.rates[stream] * self.speed) if self.speed > 0 else 0.
+        next_frame = monotonic()
+        while not self._stop.is_set():
+            self._emit(stream)
+            if interval:
+                # Absolute deadlines, so the replay rate doesn't drift with the callbacks' run time
+                next_frame += interval
+                delay = next_frame - monotonic()
+                if delay > 0:
+                    self._stop.wait(delay)
+            else:
+                sleep(0)
+
+    def _emit(self, stream):
+        with self._lock:
+            callbacks = list(self._subscribers.get(stream, []))
+            position = self._positions.get(stream, 0)
+            self._positions[stream] = position + 1
+            self.frames_sent[stream] = self.frames_sent.get(stream, 0) + 1
+        if not callbacks:
+            return
+        message = self._message(stream, position)
+        for callback in callbacks:
+            callback(message)
+
+    def _message(self, stream, position):
+        """Builds the message the SDK would send for frame number position of a stream."""
+        if stream == "status":
+            return self.status_once()
+        frames = self.frames[stream]
+        frame = frames[position % len(frames)]
+        if stream in ("raw", "raw_unfiltered"):
+            return {"data": frame.tolist()}
+        if stream == "psd":
+            return {"psd": frame.tolist()}
+        if stream == "power_by_band":
+            return {"data": {band: frame[i].tolist() for i, band in enumerate(BANDS)}}
+        if stream in ("focus", "calm"):
+            return {"probability": float(frame)}
+        if stream == "signal_quality":
+            return [{"status": "great" if std < 10 else "bad", "standardDeviation": float(std)} for std in frame]
+        raise ValueError(f"Unknown stream: {stream}")
+
+
+def synthetic_frames(num_frames=256, seed=0):
+    """Deterministic synthetic frames with the shapes of the real streams."""
+    rng = np.random.default_rng(seed)
+    return {
+        "raw": rng.normal(0, 5, (num_frames, 8, 16)),
+        "raw_unfiltered": rng.normal(0, 20, (num_frames, 8, 16)),
+        "psd": rng.gamma(2., 2., (num_frames, 8, 64)),
+        "power_by_band": rng.gamma(2., 2., (num_frames, 5, 8)),
+        "focus": rng.random(num_frames),
+        "calm": rng.random(num_frames),
+        "signal_quality": rng.gamma(2., 2., (num_frames, 8)),
+    }
+
+
+def load_recording(path):
+    with np.load(path) as recording:
+        return {stream: recording[stream] for stream in recording.files}
+
+
+def record_device(device, path, seconds):
+    """
+    Records the streams of a live device (e.g. a logged in NeurositySDK) for the given time into an .npz file
+    that ReplayDevice can replay.
+    """
+    frames = {stream: [] for stream in NATIVE_RATES if stream != "status"}
+    converters = {
+        "raw": lambda data: np.array(data["data"]),
+        "raw_unfiltered": lambda data: np.array(data["data"]),
+        "psd": lambda data: np.array(data["psd"]),
+        "power_by_band": lambda data: np.array([data["data"][band] for band in BANDS]),
+        "focus": lambda data: data["probability"],
+        "calm": lambda data: data["probability"],
+        "signal_quality": lambda data: np.array([channel["standardDeviation"] for channel in data]),
+    }
+    subscribe = {
+        "raw": device.brainwaves_raw,
+        "raw_unfiltered": device.brainwaves_raw_unfiltered,
+        "psd": device.brainwaves_psd,
+        "power_by_band": device.brainwaves_power_by_band,
+        "focus": device.focus,
+        "calm": device.calm,
+        "signal_quality": device.signal_quality,
+    }
+    unsubscribes = [
+        subscribe[stream](lambda data, stream=stream: frames[stream].append(converters[stream](data)))
+        for stream in frames
+    ]
+    sleep(seconds)
+    for unsubscribe in unsubscribes:
+        unsubscribe()
+
+    np.savez_compressed(path, **{stream: np.array(values) for stream, values in frames.items() if values})
+    print(f"Recorded {', '.join(f'{len(values)} {stream}' for stream, values in frames.items())} frames to {path}")
+
+
+class FakeSpotify:
+    """
+    Stand-in for the spotipy client (pass it as SpotifyAPI(..., api=FakeSpotify())). Plays a fixed list of tracks
+    one after another and returns deterministic audio features, without any network access.
+
+    Parameters:
+        num_tracks (int): Number of tracks in the fake playlist. Default: 10
+        track_duration (float): Seconds each track plays (in replay time, see speed). Default: 180
+        speed (float): How much faster than real time the playlist advances. Default: 1.0
+        latency (float): Seconds every API call sleeps, to simulate a slow network. Default: 0
+        manual (bool): If True the track only changes when next_track() is called. Default: False
+    """
+    def __init__(self, num_tracks=10, track_duration=180., speed=1.0, latency=0., manual=False):
+        self.tracks = [f"fake{i:04d}" for i in range(num_tracks)]
+        self.track_duration = track_duration
+        self.speed = speed
+        self.latency = latency
+        self.manual = manual
+        self.is_playing = True
+        self.calls = {}
+        self._track_index = 0
+        self._start = monotonic()
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            sleep(self.latency)
+
+    def next_track(self):
+        self._track_index += 1
+
+    def current_track_id(self):
+        if self.manual:
+            index = self._track_index
+        else:
+            index = int((monotonic() - self._start) * self.speed / self.track_duration)
+        return self.tracks[index % len(self.tracks)]
+
+    def current_user(self):
+        self._call("current_user")
+        return {"id": "fake_user", "display_name": "Fake User"}
+
+    def current_playback(self):
+        self._call("current_playback")
+        track_id = self.current_track_id()
+        return {
+            "is_playing": self.is_playing,
+            "item": {
+                "id": track_id,
+                "name": f"Track {track_id}",
+                "artists": [{"name": f"Artist {int(track_id[4:]) % 3}"}, {"name": "Featured Artist"}],
+            },
+        }
+
+    def audio_features(self, tracks):
+        self._call("audio_features")
+        if isinstance(tracks, str):
+            tracks = [tracks]
+        features = []
+        for track_id in tracks:
+            rng = np.random.default_rng(zlib.crc32(track_id.encode()))
+            features.append({
+                "acousticness": rng.random(), "danceability": rng.random(), "energy": rng.random(),
+                "instrumentalness": rng.random(), "liveness": rng.random(), "speechiness": rng.random(),
+                "valence": rng.random(), "loudness": -rng.random() * 20, "tempo": 60 + rng.random() * 120,
+                "duration_ms": int(self.track_duration * 1000), "key": int(rng.integers(0, 12)),
+                "mode": int(rng.integers(0, 2)), "time_signature": 4, "id": track_id, "type": "audio_features",
+                "uri": f"spotify:track:{track_id}", "track_href": f"https://api.spotify.com/v1/tracks/{track_id}",
+                "analysis_url": f"https://api.spotify.com/v1/audio-analysis/{track_id}",
+            })
+        return features
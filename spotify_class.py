@@ -1,49 +1,233 @@
-import json
 import sqlite3
-from os import path, mkdir, listdir
-from time import sleep, time
-import requests
+from datetime import datetime
+import os
+from threading import Lock
 
 import numpy as np
 
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-import requests
-from datetime import datetime
-import os
-import pandas as pd
+from cache_class import LRUCache
+from database_class import DatabaseWriter
+from blob_codec import encode_array, decode_array
+from eeg_loader import load_eeg_metrics, LEGACY_BLOB_SHAPES
+from neurosity_class import SAMPLE_PSD_SHAPE, SAMPLE_BANDS_SHAPE
+
+
+# Dispersion columns of eeg_metrics, added after the table was first released
+EEG_STATS_COLUMNS = [
+    ("psd_var", "BLOB"),
+    ("alpha_var", "BLOB"),
+    ("beta_var", "BLOB"),
+    ("delta_var", "BLOB"),
+    ("gamma_var", "BLOB"),
+    ("theta_var", "BLOB"),
+    ("focus_var", "REAL"),
+    ("calm_var", "REAL"),
+    ("sample_count", "INTEGER"),
+]
+
+# Audio feature columns of song_metrics, used to rebuild a features dict from the database
+AUDIO_FEATURE_COLUMNS = [
+    "id", "acousticness", "danceability", "duration_ms", "energy", "instrumentalness", "key", "liveness",
+    "loudness", "mode", "speechiness", "tempo", "time_signature", "valence", "uri"
+]
+
 
 class SpotifyAPI:
+    """
+    Wrapper around the Spotify Web API and the SQLite database the collected data is stored in.
+
+    Parameters:
+        client_id (str): Spotify client ID.
+        client_secret (str): Spotify client secret.
+        db_name (str): Database whose song_metrics table backs the audio features cache, so features fetched
+            in earlier sessions are not fetched again. Default: None (in-memory cache only)
+        feature_cache_size (int): Number of tracks kept in the in-memory audio features cache. Default: 256
+        feature_cache_ttl (float): Seconds an in-memory audio features entry stays valid. Default: 24 hours
+        blob_dtype: dtype EEG vectors are stored with in eeg_metrics. Default: float32
+        compress_blobs (bool): zlib-compress the EEG vector BLOBs. Default: False
+        api: Client to use instead of an OAuth spotipy.Spotify, e.g. simulator_class.FakeSpotify for running
+            without network access. Default: None
+    """
+
+    def __init__(self, client_id, client_secret, db_name=None, feature_cache_size=256, feature_cache_ttl=24 * 3600,
+                 blob_dtype=np.float32, compress_blobs=False, api=None):
+        # The Spotify client is created on first use (spotipy is only imported then), so constructing this class
+        # doesn't wait for the network. The user profile is fetched by get_current_user(), call it before writing
+        # so the rows carry the user. The writer thread only reads user_id/user_name, it never fetches them.
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.sp_oauth = None
+        self._api = api
+        self._user = None
+        self.user_id = None
+        self.user_name = None
+        self._client_lock = Lock()
+        self._user_lock = Lock()
+
+        # Long-lived database connections, one writer thread and one read connection per database file
+        self._writers = {}
+        self._writer_lock = Lock()
+        self._readers = {}
+        self._reader_lock = Lock()
+
+        # Audio features never change for a track, so they are fetched from Spotify at most once
+        self.db_name = db_name
+        self.feature_cache = LRUCache(feature_cache_size, feature_cache_ttl)
+        self.feature_db_hits = 0
+        self.feature_api_calls = 0
+
+        self.blob_dtype = blob_dtype
+        self.compress_blobs = compress_blobs
+
+    def _get_writer(self, db_name):
+        """Returns the background DatabaseWriter for db_name, starting it on first use."""
+        writer = self._writers.get(db_name)
+        if writer is None or writer.closed:
+            # The PlaybackMonitor worker and the main thread both write, only one of them may start the writer
+            with self._writer_lock:
+                writer = self._writers.get(db_name)
+                if writer is None or writer.closed:
+                    writer = DatabaseWriter(db_name)
+                    self._writers[db_name] = writer
+        return writer
+
+    def _get_reader(self, db_name, flush=True):
+        """
+        Returns a long-lived read connection for db_name. By default queued writes are flushed first so reads
+        see them, pass flush=False for lookups that don't need the latest writes.
+        """
+        if flush and db_name in self._writers:
+            self._writers[db_name].flush()
+        conn = self._readers.get(db_name)
+        if conn is None:
+            conn = sqlite3.connect(db_name, check_same_thread=False)
+            self._readers[db_name] = conn
+        return conn
+
+    def flush(self, db_name=None):
+        """Blocks until all queued writes (for db_name, or for every database) are committed."""
+        for name, writer in list(self._writers.items()):
+            if db_name is None or name == db_name:
+                writer.flush()
+
+    def close(self, db_name=None):
+        """Flushes and closes the database connections (for db_name, or for every database)."""
+        with self._writer_lock:
+            writers = [self._writers.pop(name) for name in list(self._writers) if db_name is None or name == db_name]
+        for writer in writers:
+            writer.close()
+        for name in list(self._readers):
+            if db_name is None or name == db_name:
+                self._readers.pop(name).close()
+
+    @property
+    def API(self):
+        """The Spotify client, an OAuth spotipy.Spotify created on first use (or the api passed in)."""
+        if self._api is None:
+            self._create_client()
+        return self._api
+
+    def _create_client(self):
+        """Creates the OAuth spotipy.Spotify client and its sp_oauth, unless a client exists already."""
+        with self._client_lock:
+            if self._api is None:
+                import spotipy
+                from spotipy.oauth2 import SpotifyOAuth
+
+                self.sp_oauth = SpotifyOAuth(
+                    client_id=self.client_id,
+                    client_secret=self.client_secret,
+                    redirect_uri="https://open.spotify.com/",
+                    scope="user-read-playback-state user-read-currently-playing"
+                )
+                self._api = spotipy.Spotify(auth_manager=self.sp_oauth)
+
+    def get_current_user(self, refresh=False):
+        """
+        Retrieves the current user's information from Spotify. It's fetched once and then cached, and sets the
+        user_id and user_name the rows are written with.
 
-    def __init__(self, client_id, client_secret):
-        self.sp_oauth = SpotifyOAuth(
-            client_id=client_id,
-            client_secret=client_secret,
-            redirect_uri="https://open.spotify.com/",
-            scope="user-read-playback-state user-read-currently-playing"
-        )
-        self.API = spotipy.Spotify(auth_manager=self.sp_oauth)
+        Parameters:
+            refresh (bool): Fetch it from Spotify again. Default: False
 
-        self.user_id = self.get_current_user()["id"]
-        self.user_name = self.get_current_user()["display_name"]
-    def get_current_user(self):
+        Returns:
+            dict: A dictionary containing the current user's information, or None if it couldn't be retrieved
+            (it's fetched again on the next call then).
+        """
+        if self._user is not None and not refresh:
+            return self._user
+        # Callers on other threads wait for a fetch in progress instead of starting another one
+        with self._user_lock:
+            if self._user is not None and not refresh:
+                return self._user
+            try:
+                user_info = self.API.current_user()
+                # print("user info: ", user_info)
+                self._user = user_info
+                self.user_id = user_info["id"]
+                self.user_name = user_info["display_name"]
+                return user_info
+            except Exception as e:
+                print(f"An error occurred while retrieving the current user: {e}")
+                return None
+
+    def get_cached_audio_features(self, track_id):
         """
-        Retrieves the current user's information from Spotify.
+        Returns the raw audio features for a track, looking in the in-memory cache first, then in the
+        song_metrics table of self.db_name, and only then calling the Spotify API.
 
         Returns:
-            dict: A dictionary containing the current user's information.
+            dict: The audio features, or None if Spotify has none for the track.
         """
+        features = self.feature_cache.get(track_id)
+        if features is not None:
+            return features
+
+        features = self._load_audio_features_from_DB(track_id)
+        if features is not None:
+            self.feature_db_hits += 1
+        else:
+            self.feature_api_calls += 1
+            features = self.API.audio_features(track_id)[0]
+            if not features:
+                return None
+
+        self.feature_cache.put(track_id, features)
+        return features
+
+    def _load_audio_features_from_DB(self, track_id):
+        if self.db_name is None or not os.path.exists(self.db_name):
+            return None
         try:
-            user_info = self.API.current_user()
-            # print("user info: ", user_info)
-            return user_info
-        except Exception as e:
-            print(f"An error occurred while retrieving the current user: {e}")
+            # Features of queued songs are still in feature_cache (they're put there before the song is written),
+            # so the lookup doesn't have to wait for the writer. A miss at worst costs one extra API call.
+            with self._reader_lock:
+                row = self._get_reader(self.db_name, flush=False).execute(
+                    f"SELECT {', '.join(AUDIO_FEATURE_COLUMNS)} FROM song_metrics WHERE id = ?", (track_id,)
+                ).fetchone()
+        except sqlite3.Error:
+            # e.g. the table doesn't exist yet
             return None
+        if row is None:
+            return None
+
+        features = dict(zip(AUDIO_FEATURE_COLUMNS, row))
+        # Not stored in the table, but derived from the ID the same way Spotify builds them
+        features["type"] = "audio_features"
+        features["track_href"] = f"https://api.spotify.com/v1/tracks/{track_id}"
+        features["analysis_url"] = f"https://api.spotify.com/v1/audio-analysis/{track_id}"
+        return features
+
+    def get_feature_cache_stats(self):
+        """Returns hit/miss counters of the audio features cache."""
+        stats = self.feature_cache.stats()
+        stats["db_hits"] = self.feature_db_hits
+        stats["api_calls"] = self.feature_api_calls
+        return stats
 
     def get_audio_features(self, track_id):
         # Retrieve audio features for the given track
-        features = self.API.audio_features(track_id)[0]
+        features = self.get_cached_audio_features(track_id)
 
 
         if features:
@@ -72,13 +256,21 @@ class SpotifyAPI:
             return None
 
     def get_audio_analysis(self, track_id):
+        import requests
+
+        if self._api is None:
+            self._create_client()
+        if self.sp_oauth is None:
+            print("Audio analysis needs an OAuth Spotify client.")
+            return None
+
         # Refresh token if necessary
         token_info = self.sp_oauth.get_access_token()
         access_token = token_info['access_token']
 
         # Get audio features, including the analysis_url
-        features = self.API.audio_features(track_id)[0]
-        analysis_url = features.get("analysis_url")
+        features = self.get_cached_audio_features(track_id)
+        analysis_url = features.get("analysis_url") if features else None
 
         if analysis_url:
             headers = {"Authorization": f"Bearer {access_token}"}
@@ -96,9 +288,14 @@ class SpotifyAPI:
 
 
     def delete_database(self, db_name="music_focus.db"):
+        self.close(db_name)
         try:
             if os.path.exists(db_name):
                 os.remove(db_name)
+                # WAL mode leaves these next to the database
+                for suffix in ("-wal", "-shm"):
+                    if os.path.exists(db_name + suffix):
+                        os.remove(db_name + suffix)
                 print(f"Database '{db_name}' deleted successfully.")
             else:
                 print(f"Database '{db_name}' does not exist.")
@@ -106,26 +303,33 @@ class SpotifyAPI:
             print(f"An error occurred while deleting the database: {e}")
 
     def clear_database(self, db_name="music_focus.db"):
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
+        writer = self._get_writer(db_name)
 
-        # Clear all data from the tables
-        cursor.execute('''
-            DELETE FROM song_metrics
+        # Clear all data from the tables (children first, the writer enforces foreign keys)
+        writer.execute('''
+            DELETE FROM eeg_samples
         ''')
-        cursor.execute('''
+        writer.execute('''
+            DELETE FROM eeg_metrics
+        ''')
+        writer.execute('''
             DELETE FROM artists
         ''')
-        cursor.execute('''
-            DELETE FROM eeg_metrics
+        writer.execute('''
+            DELETE FROM song_metrics
         ''')
 
-        conn.commit()
-        conn.close()
+        writer.flush()
         print("Database cleared successfully.")
 
     def initialize_database(self, db_name="music_focus.db"):
-        conn = sqlite3.connect(db_name)
+        writer = self._get_writer(db_name)
+        writer.call(self._create_tables)
+        writer.flush()
+        print("Database initialized successfully with song, artist, and EEG tables.")
+
+    @staticmethod
+    def _create_tables(conn):
         cursor = conn.cursor()
 
         # Create table for song metrics (without date and time fields)
@@ -175,6 +379,15 @@ class SpotifyAPI:
                 theta BLOB,  -- Stores theta as a vector of length 8
                 focus_score REAL,   -- Stores focus score as a float
                 calm_score REAL,    -- Stores calm score as a float
+                psd_var BLOB,       -- Per-bin variance of the PSD samples behind the mean
+                alpha_var BLOB,
+                beta_var BLOB,
+                delta_var BLOB,
+                gamma_var BLOB,
+                theta_var BLOB,
+                focus_var REAL,
+                calm_var REAL,
+                sample_count INTEGER,  -- Number of EEG samples the means were computed from
                 user_id TEXT,
                 user_name TEXT,
                 year INTEGER,
@@ -186,18 +399,48 @@ class SpotifyAPI:
             )
         ''')
 
-        conn.commit()
-        conn.close()
-        print("Database initialized successfully with song, artist, and EEG tables.")
+        # Create a table for the individual EEG samples behind the per-song averages.
+        # No foreign key: samples are written in batches while the song plays, possibly before its song_metrics row.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS eeg_samples (
+                song_id TEXT,
+                t REAL,      -- Seconds since the song started (monotonic clock)
+                data BLOB,   -- float32 PSD (8, 26) followed by power by band (5, 8)
+                focus REAL,
+                calm REAL,
+                quality REAL -- Signal quality score (fraction of channels with good contact), NULL if not monitored
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_eeg_samples_song ON eeg_samples (song_id, t)")
+        if "quality" not in [row[1] for row in cursor.execute("PRAGMA table_info(eeg_samples)")]:
+            cursor.execute("ALTER TABLE eeg_samples ADD COLUMN quality REAL")
+
+        # Databases created before the dispersion columns existed get them added in place
+        existing_columns = [row[1] for row in cursor.execute("PRAGMA table_info(eeg_metrics)")]
+        for column, column_type in EEG_STATS_COLUMNS:
+            if column not in existing_columns:
+                cursor.execute(f"ALTER TABLE eeg_metrics ADD COLUMN {column} {column_type}")
+
+        # Indexes for the per-song lookups and the aggregation queries (mean_focus_by_artist and friends)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_eeg_metrics_song ON eeg_metrics (song_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_eeg_metrics_user_time ON eeg_metrics (user_id, timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_eeg_metrics_hour_weekday ON eeg_metrics (hour, weekday)")
+
+        # An artist is listed once per song. Databases from before the constraint may have duplicates, which
+        # have to go before the UNIQUE index can be created.
+        has_unique_index = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_artists_song_artist'").fetchone()
+        if not has_unique_index:
+            cursor.execute(
+                "DELETE FROM artists WHERE id NOT IN (SELECT MIN(id) FROM artists GROUP BY song_id, artist_name)")
+            cursor.execute("CREATE UNIQUE INDEX idx_artists_song_artist ON artists (song_id, artist_name)")
 
     def add_eeg_metrics(self, song_id, eeg_data, db_name="music_focus.db"):
         # Debug prints to confirm function is called with correct values
 
         # print("EEG Data:", eeg_data)
 
-        conn = sqlite3.connect(db_name)
-        conn.execute("PRAGMA foreign_keys = ON")  # Enable foreign keys
-        cursor = conn.cursor()
+        writer = self._get_writer(db_name)  # foreign keys are enforced by the writer connection
 
         # Current timestamp and date/time fields
         timestamp = datetime.now()
@@ -209,33 +452,102 @@ class SpotifyAPI:
 
         print(f"Inserting EEG data for song {song_id} with timestamp: {timestamp}")
 
-        # Convert vectors to binary (BLOB format)
-        psd_blob = sqlite3.Binary(eeg_data["psd"].tobytes())
-        alpha_blob = sqlite3.Binary(eeg_data["alpha"].tobytes())
-        beta_blob = sqlite3.Binary(np.array(eeg_data["beta"]).tobytes())
-        delta_blob = sqlite3.Binary(np.array(eeg_data["delta"]).tobytes())
-        gamma_blob = sqlite3.Binary(np.array(eeg_data["gamma"]).tobytes())
-        theta_blob = sqlite3.Binary(np.array(eeg_data["theta"]).tobytes())
-
-        cursor.execute('''
+        # Convert vectors to binary (versioned BLOB format, see blob_codec)
+        psd_blob = self._encode_blob(eeg_data["psd"])
+        alpha_blob = self._encode_blob(eeg_data["alpha"])
+        beta_blob = self._encode_blob(eeg_data["beta"])
+        delta_blob = self._encode_blob(eeg_data["delta"])
+        gamma_blob = self._encode_blob(eeg_data["gamma"])
+        theta_blob = self._encode_blob(eeg_data["theta"])
+
+        # Variances are optional, older callers only pass the means
+        var_blobs = [
+            self._encode_blob(eeg_data[key]) if eeg_data.get(key) is not None else None
+            for key in ("psd_var", "alpha_var", "beta_var", "delta_var", "gamma_var", "theta_var")
+        ]
+
+        writer.execute('''
             INSERT INTO eeg_metrics (
-                song_id, timestamp, psd, alpha, beta, delta, gamma, theta, 
-                focus_score, calm_score, user_id, user_name, year, month, day, weekday, hour
+                song_id, timestamp, psd, alpha, beta, delta, gamma, theta,
+                focus_score, calm_score, psd_var, alpha_var, beta_var, delta_var, gamma_var, theta_var,
+                focus_var, calm_var, sample_count, user_id, user_name, year, month, day, weekday, hour
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             song_id, timestamp, psd_blob, alpha_blob, beta_blob, delta_blob, gamma_blob, theta_blob,
-            eeg_data["focus"], eeg_data["calm"], self.user_id, self.user_name, year, month, day, weekday, hour
+            eeg_data["focus"], eeg_data["calm"], *var_blobs,
+            eeg_data.get("focus_var"), eeg_data.get("calm_var"), eeg_data.get("sample_count"),
+            self.user_id, self.user_name, year, month, day, weekday, hour
         ))
 
-        # Commit changes to ensure data is saved
-        conn.commit()
-        conn.close()
-        print("EEG metrics successfully added to database.")
+        # The writer thread commits it in the background
+        print("EEG metrics queued for the database.")
+
+
+    def _encode_blob(self, vector):
+        return sqlite3.Binary(encode_array(np.asarray(vector), self.blob_dtype, self.compress_blobs))
+
+    def add_eeg_samples(self, song_id, samples, db_name="music_focus.db", min_quality=None):
+        """
+        Queues per-sample EEG records (from NeurosityVectorizer.drain_samples) for a song.
+        They are inserted with a single executemany on the writer thread.
+
+        Args:
+            song_id (str): The ID of the song the samples belong to.
+            samples (list): (t, blob, focus, calm, quality) records. quality may be None (or missing) if the
+                signal quality wasn't monitored.
+            db_name (str): Name of the SQLite database.
+            min_quality (float): Leave out the records tagged with a lower quality score (bad contact).
+                Untagged records are kept. Default: None (keep everything)
+        """
+        rows = [(song_id, *record[:4], record[4] if len(record) > 4 else None) for record in samples]
+        if min_quality is not None:
+            rows = [row for row in rows if row[5] is None or row[5] >= min_quality]
+        if not rows:
+            return
+        self._get_writer(db_name).executemany(
+            "INSERT INTO eeg_samples (song_id, t, data, focus, calm, quality) VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+
+    def get_eeg_samples_from_DB(self, song_id, db_name="music_focus.db"):
+        """
+        Fetches the per-sample EEG time series of a song as contiguous NumPy arrays.
+
+        Args:
+            song_id (str): The ID of the song to fetch EEG samples for.
+            db_name (str): Name of the SQLite database.
+
+        Returns:
+            dict: "t" (N,), "psd" (N, 8, 26), "bands" (N, 5, 8), "focus" (N,), "calm" (N,), "quality" (N,),
+                ordered by time, or None if the song has no samples. Missing focus/calm/quality values are NaN.
+        """
+        with self._reader_lock:
+            rows = self._get_reader(db_name).execute(
+                "SELECT t, data, focus, calm, quality FROM eeg_samples WHERE song_id = ? ORDER BY t", (song_id,)
+            ).fetchall()
+
+        if len(rows) == 0:
+            print(f"No EEG samples found for song ID: {song_id}")
+            return None
 
+        t, blobs, focus, calm, quality = zip(*rows)
+        # All records have the same size, so one frombuffer over the joined blobs decodes every row at once
+        data = np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(len(rows), -1)
+        psd_size = int(np.prod(SAMPLE_PSD_SHAPE))
+        return {
+            "t": np.array(t),
+            "psd": data[:, :psd_size].reshape((len(rows),) + SAMPLE_PSD_SHAPE),
+            "bands": data[:, psd_size:].reshape((len(rows),) + SAMPLE_BANDS_SHAPE),
+            "focus": np.array(focus, dtype=np.float64),
+            "calm": np.array(calm, dtype=np.float64),
+            "quality": np.array(quality, dtype=np.float64)
+        }
 
     def add_song_to_database(self, song_data, db_name="music_focus.db"):
-        conn = sqlite3.connect(db_name)
+        self._get_writer(db_name).call(lambda conn: self._insert_song(conn, song_data))
+        print(f"Song '{song_data['track_name']}' with artists queued for the database.")
+
+    def _insert_song(self, conn, song_data):
         cursor = conn.cursor()
 
         # Insert song data into song_metrics (without date and time fields)
@@ -256,53 +568,68 @@ class SpotifyAPI:
         ))
 
         # Insert each artist into the artists table only if not already present for this song
-        for artist in song_data['artists']:
-            # Check if artist is already in the table for this song_id
-            cursor.execute('''
-                SELECT 1 FROM artists WHERE song_id = ? AND artist_name = ?
-            ''', (song_data['id'], artist))
-            if cursor.fetchone() is None:
-                # Artist is not present, so insert it
-                cursor.execute('''
-                    INSERT INTO artists (song_id, artist_name) 
-                    VALUES (?, ?)
-                ''', (song_data['id'], artist))
-
-        conn.commit()
-        conn.close()
-        print(f"Song '{song_data['track_name']}' with artists added to database.")
+        # (the UNIQUE (song_id, artist_name) index makes the duplicates no-ops)
+        cursor.executemany('''
+            INSERT OR IGNORE INTO artists (song_id, artist_name)
+            VALUES (?, ?)
+        ''', [(song_data['id'], artist) for artist in song_data['artists']])
 
-    # Example function to get current song metrics and add to database with artists
-    def get_current_song_metrics(self):
+    def get_current_track(self):
+        """
+        Lightweight "what is playing?" poll. Only calls current_playback, never fetches audio features.
+
+        Returns:
+            dict: {"id", "track_name", "artists", "is_playing"} of the current track, or None if there is none.
+                is_playing is False while playback is paused.
+        """
         current_track = self.API.current_playback()
         if current_track and current_track['item']:
-            track_id = current_track['item']['id']
-            track_name = current_track['item']['name']
-            artists = [artist['name'] for artist in current_track['item']['artists']]
-
-            features = self.API.audio_features(track_id)[0]
             return {
-                "id": features.get("id"),
-                "track_name": track_name,
-                "artists": artists,  # List of artist names
-                "acousticness": features.get("acousticness"),
-                "danceability": features.get("danceability"),
-                "duration_ms": features.get("duration_ms"),
-                "energy": features.get("energy"),
-                "instrumentalness": features.get("instrumentalness"),
-                "key": features.get("key"),
-                "liveness": features.get("liveness"),
-                "loudness": features.get("loudness"),
-                "mode": features.get("mode"),
-                "speechiness": features.get("speechiness"),
-                "tempo": features.get("tempo"),
-                "time_signature": features.get("time_signature"),
-                "valence": features.get("valence"),
-                "uri": features.get("uri")
+                "id": current_track['item']['id'],
+                "track_name": current_track['item']['name'],
+                "artists": [artist['name'] for artist in current_track['item']['artists']],  # List of artist names
+                "is_playing": current_track.get('is_playing', True)
             }
-        else:
+        return None
+
+    def get_song_metrics(self, track):
+        """
+        Resolves the full song metrics (track info plus audio features) for a track returned by get_current_track.
+
+        Returns:
+            dict: The song metrics in the format add_song_to_database expects, or None if there are no features.
+        """
+        features = self.get_cached_audio_features(track["id"])
+        if features is None:
+            print(f"No audio features found for track {track['track_name']}.")
+            return None
+        return {
+            "id": features.get("id"),
+            "track_name": track["track_name"],
+            "artists": track["artists"],  # List of artist names
+            "acousticness": features.get("acousticness"),
+            "danceability": features.get("danceability"),
+            "duration_ms": features.get("duration_ms"),
+            "energy": features.get("energy"),
+            "instrumentalness": features.get("instrumentalness"),
+            "key": features.get("key"),
+            "liveness": features.get("liveness"),
+            "loudness": features.get("loudness"),
+            "mode": features.get("mode"),
+            "speechiness": features.get("speechiness"),
+            "tempo": features.get("tempo"),
+            "time_signature": features.get("time_signature"),
+            "valence": features.get("valence"),
+            "uri": features.get("uri")
+        }
+
+    # Example function to get current song metrics and add to database with artists
+    def get_current_song_metrics(self):
+        track = self.get_current_track()
+        if track is None:
             print("No track currently playing.")
             return None
+        return self.get_song_metrics(track)
 
     def get_eeg_data_from_DB(self, song_id, db_name="music_focus.db"):
         """
@@ -315,18 +642,15 @@ class SpotifyAPI:
         Returns:
             pd.DataFrame: A DataFrame containing the processed EEG data.
         """
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
-
         # Fetch EEG data for the specified song ID
-        cursor.execute('''
+        with self._reader_lock:
+            cursor = self._get_reader(db_name).execute('''
             SELECT song_id, timestamp, psd, alpha, beta, delta, gamma, theta, 
                    focus_score, calm_score, year, month, day, weekday, hour 
             FROM eeg_metrics 
             WHERE song_id = ?
-        ''', (song_id,))
-        eeg_data = cursor.fetchall()
-        conn.close()
+            ''', (song_id,))
+            eeg_data = cursor.fetchall()
 
         # Process the data
         processed_data = []
@@ -336,13 +660,14 @@ class SpotifyAPI:
                 focus_score, calm_score, year, month, day, weekday, hour
             ) = row
 
-            # Decode binary blobs into numpy arrays
-            psd = np.frombuffer(psd_blob, dtype=np.float64)
-            alpha = np.frombuffer(alpha_blob, dtype=np.float64)
-            beta = np.frombuffer(beta_blob, dtype=np.float64)
-            delta = np.frombuffer(delta_blob, dtype=np.float64)
-            gamma = np.frombuffer(gamma_blob, dtype=np.float64)
-            theta = np.frombuffer(theta_blob, dtype=np.float64)
+            # Decode binary blobs into numpy arrays. Versioned blobs carry their dtype and shape,
+            # legacy float64 blobs get the shapes they were written with.
+            psd = decode_array(psd_blob, LEGACY_BLOB_SHAPES["psd"])
+            alpha = decode_array(alpha_blob, LEGACY_BLOB_SHAPES["alpha"])
+            beta = decode_array(beta_blob, LEGACY_BLOB_SHAPES["beta"])
+            delta = decode_array(delta_blob, LEGACY_BLOB_SHAPES["delta"])
+            gamma = decode_array(gamma_blob, LEGACY_BLOB_SHAPES["gamma"])
+            theta = decode_array(theta_blob, LEGACY_BLOB_SHAPES["theta"])
 
             # Append structured data
             processed_data.append({
@@ -368,3 +693,124 @@ class SpotifyAPI:
             return None
 
         return processed_data
+
+    def load_eeg_metrics(self, db_name="music_focus.db", song_ids=None, user_id=None, as_dataframe=False):
+        """
+        Bulk loads EEG metrics for many songs at once, for analysis across sessions.
+        Unlike get_eeg_data_from_DB, all rows are read in one query and each BLOB column is decoded
+        into a stacked 2-D array in a single pass.
+
+        Args:
+            db_name (str): Name of the SQLite database.
+            song_ids (list): Only load these songs. Default: None (all songs)
+            user_id (str): Only load this user's rows. Default: None (all users)
+            as_dataframe (bool): Return a pandas DataFrame instead of a dict of arrays. Default: False
+
+        Returns:
+            dict: "psd" (N, 208), "alpha".."theta" (N, 8) and one (N,) array per scalar column, or a DataFrame.
+        """
+        with self._reader_lock:
+            return load_eeg_metrics(self._get_reader(db_name), song_ids, user_id, as_dataframe)
+
+    def _query(self, db_name, sql, params=()):
+        """Runs a read query on the reader connection and returns the rows as dicts."""
+        with self._reader_lock:
+            cursor = self._get_reader(db_name).execute(sql, params)
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    @staticmethod
+    def _metrics_filter(user_id=None, since=None, until=None):
+        """WHERE clause (and its parameters) restricting eeg_metrics rows e to a user and a time range."""
+        conditions = []
+        params = []
+        if user_id is not None:
+            conditions.append("e.user_id = ?")
+            params.append(user_id)
+        # Timestamps are stored as "YYYY-MM-DD HH:MM:SS.ffffff" text, which sorts chronologically
+        if since is not None:
+            conditions.append("e.timestamp >= ?")
+            params.append(since.isoformat(" "))
+        if until is not None:
+            conditions.append("e.timestamp < ?")
+            params.append(until.isoformat(" "))
+        return ("WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+    def mean_focus_by_artist(self, db_name="music_focus.db", user_id=None, since=None, until=None, min_listens=1):
+        """
+        Mean focus and calm per artist over all listens of their songs, computed in SQL.
+
+        Args:
+            db_name (str): Name of the SQLite database.
+            user_id (str): Only count this user's listens. Default: None (all users)
+            since (datetime): Only count listens from this time on. Default: None
+            until (datetime): Only count listens before this time. Default: None
+            min_listens (int): Leave out artists with fewer listens. Default: 1
+
+        Returns:
+            list: {"artist_name", "mean_focus", "mean_calm", "listens"} dicts, highest mean focus first.
+        """
+        where, params = self._metrics_filter(user_id, since, until)
+        return self._query(db_name, f'''
+            SELECT a.artist_name, AVG(e.focus_score) AS mean_focus, AVG(e.calm_score) AS mean_calm,
+                   COUNT(*) AS listens
+            FROM eeg_metrics e JOIN artists a ON a.song_id = e.song_id
+            {where}
+            GROUP BY a.artist_name
+            HAVING COUNT(*) >= ?
+            ORDER BY mean_focus DESC
+        ''', (*params, min_listens))
+
+    def mean_focus_by_hour(self, db_name="music_focus.db", user_id=None, since=None, until=None, weekday=None):
+        """
+        Mean focus and calm per hour of the day, computed in SQL.
+
+        Args:
+            db_name (str): Name of the SQLite database.
+            user_id (str): Only count this user's listens. Default: None (all users)
+            since (datetime): Only count listens from this time on. Default: None
+            until (datetime): Only count listens before this time. Default: None
+            weekday (int): Only count listens on this weekday (0 = Monday, 6 = Sunday). Default: None
+
+        Returns:
+            list: {"hour", "mean_focus", "mean_calm", "listens"} dicts, ordered by hour. Hours without listens are left out.
+        """
+        where, params = self._metrics_filter(user_id, since, until)
+        if weekday is not None:
+            where = (where + " AND " if where else "WHERE ") + "e.weekday = ?"
+            params.append(weekday)
+        return self._query(db_name, f'''
+            SELECT e.hour, AVG(e.focus_score) AS mean_focus, AVG(e.calm_score) AS mean_calm, COUNT(*) AS listens
+            FROM eeg_metrics e
+            {where}
+            GROUP BY e.hour
+            ORDER BY e.hour
+        ''', params)
+
+    def top_tracks_by_calm(self, db_name="music_focus.db", limit=10, user_id=None, since=None, until=None,
+                           min_listens=1):
+        """
+        The tracks with the highest mean calm over their listens, computed in SQL.
+
+        Args:
+            db_name (str): Name of the SQLite database.
+            limit (int): Number of tracks to return. Default: 10
+            user_id (str): Only count this user's listens. Default: None (all users)
+            since (datetime): Only count listens from this time on. Default: None
+            until (datetime): Only count listens before this time. Default: None
+            min_listens (int): Leave out tracks with fewer listens. Default: 1
+
+        Returns:
+            list: {"song_id", "track_name", "mean_calm", "mean_focus", "listens"} dicts, calmest first.
+        """
+        where, params = self._metrics_filter(user_id, since, until)
+        return self._query(db_name, f'''
+            SELECT e.song_id, s.track_name, AVG(e.calm_score) AS mean_calm, AVG(e.focus_score) AS mean_focus,
+                   COUNT(*) AS listens
+            FROM eeg_metrics e JOIN song_metrics s ON s.id = e.song_id
+            {where}
+            GROUP BY e.song_id
+            HAVING COUNT(*) >= ?
+            ORDER BY mean_calm DESC
+            LIMIT ?
+        ''', (*params, min_listens, limit))